@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+import data.convertMat as convert
+import data.synthetic as synthetic
+import classify.signalLearning as sigLearn
+import classify.leastSquares as leastSquares
+import classify.sweep as sweep
+import classify.metrics as metrics
+import classify.features as features
+import classify.online as online
+import classify.instrument as instrument
+import classify.projection as projection
+import scikits.learn.cross_val as cross_val
+import testModules
+import numpy
+import argparse
+import json
+import platform
+import copy
+import time
+import os
+import sys
+import shutil
+import tempfile
+import traceback
+
+"""
+Timing comparisons between the original per-channel processing routines and
+their batched replacements, for use in IPython sessions. Each benchmark takes
+an initialised ExperimentData object, e.g.:
+   data = convert.ExperimentData("data/subject_x_task.mat")
+   benchSpectralDecomp(data, 32)
+and checks that both paths give the same results before reporting timings.
+
+runSuite (or running this file as a script) instead times and memory-profiles
+every stage of the pipeline on synthetic data, writing the results as JSON so
+that they can be compared across changes, e.g.:
+   python benchmarks.py --subjects 8 --epochs 300 --output before.json
+"""
+
+def _bestOf(repeats, function, *args):
+   """
+   Returns the fastest wall-clock time of repeats calls to function, along
+   with the result of the last call.
+   """
+   best = None
+   for repeat in range(repeats):
+      start = time.time()
+      result = function(*args)
+      elapsed = time.time() - start
+      if best == None or elapsed < best:
+         best = elapsed
+   return best, result
+
+def _measured(function, *args):
+   """
+   Runs function(*args) in a forked child process, so that its peak memory
+   use is measured in isolation from everything run before it.
+   Returns the wall-clock time in seconds and the peak RSS in MB of the
+   child (or of any worker process it started, whichever is larger).
+   """
+   read, write = os.pipe()
+   pid = os.fork()
+   if pid == 0:
+      status = 1
+      try:
+         os.close(read)
+         start = time.time()
+         function(*args)
+         os.write(write, repr(time.time() - start))
+         status = 0
+      except:
+         traceback.print_exc()
+      finally:
+         os._exit(status)
+   os.close(write)
+   elapsed = os.read(read, 64)
+   os.close(read)
+   pid, status, usage = os.wait4(pid, 0)
+   if status != 0:
+      raise RuntimeError("benchmarked function failed")
+   # ru_maxrss is in kilobytes on Linux
+   return float(elapsed), usage.ru_maxrss / 1024.
+
+def benchSpectralDecomp(data, bins, subjectIndex = None, repeats = 3):
+   """
+   Compares getSpectralDecomp against getSpectralDecompArray.
+   Returns the (loop, batched) timings in seconds.
+   """
+   sigLearnInstance = sigLearn.SignalLearn()
+   loopTime, (loopSample, loopClasses) = _bestOf(repeats,
+         sigLearnInstance.getSpectralDecomp, data, bins, subjectIndex)
+   batchTime, (batchSample, batchClasses) = _bestOf(repeats,
+         sigLearnInstance.getSpectralDecompArray, data, bins, subjectIndex)
+
+   assert(numpy.array_equal(numpy.asanyarray(loopClasses), batchClasses))
+   assert(numpy.allclose(numpy.asanyarray(loopSample), batchSample))
+   print "getSpectralDecomp:      {0:.4f}s".format(loopTime)
+   print "getSpectralDecompArray: {0:.4f}s ({1:.1f}x)".format(batchTime, loopTime / batchTime)
+   return loopTime, batchTime
+
+def benchPowerSpectrum(data, bins, subjectIndex = None, repeats = 3):
+   """
+   Compares the throughput of the per-channel getSpectralDecomp path against
+   the batched Welch and multitaper estimates of getPowerSpectrumArray.
+   Returns a dict of timings in seconds.
+   """
+   sigLearnInstance = sigLearn.SignalLearn()
+   timings = {}
+   timings['getSpectralDecomp'], result = _bestOf(repeats,
+         sigLearnInstance.getSpectralDecomp, data, bins, subjectIndex)
+   for method in ['welch', 'multitaper']:
+      timings[method], result = _bestOf(repeats,
+            sigLearnInstance.getPowerSpectrumArray, data, bins, subjectIndex, method)
+   epochs = len(result[1])
+   for name in ['getSpectralDecomp', 'welch', 'multitaper']:
+      print "{0:18} {1:.4f}s ({2:.0f} epochs/s)".format(name, timings[name],
+            epochs / timings[name])
+   return timings
+
+def benchFeatures(data, subjectIndex = None, repeats = 3):
+   """
+   Compares RMS per channel per epoch (as getRmsList used to) against the
+   vectorised getRmsList, and the features module run once per feature type
+   against getFeatureMatrix computing them all in a single pass.
+   Returns a dict of timings in seconds.
+   """
+   sigLearnInstance = sigLearn.SignalLearn()
+   tasks = list(sigLearnInstance._selectTasks(data, subjectIndex))
+   def rmsLoop():
+      return [[sigLearnInstance.rootMeanSquare(channel) for channel in epoch]
+              for task in tasks for epoch in sigLearnInstance._epochView(task)]
+   def separatePasses():
+      return numpy.hstack([numpy.vstack([features.epochFeatures(sigLearnInstance._epochView(task),
+                                                                task.sampleRate, [feature])
+                                         for task in tasks])
+                           for feature in features.FEATURES])
+
+   timings = {}
+   timings['RMS loop'], loopRms = _bestOf(repeats, rmsLoop)
+   timings['getRmsList'], (rms, classes) = _bestOf(repeats, sigLearnInstance.getRmsList,
+         data, subjectIndex)
+   assert(numpy.allclose(loopRms, rms))
+   timings['pass per feature'], separate = _bestOf(repeats, separatePasses)
+   timings['getFeatureMatrix'], (sample, classes) = _bestOf(repeats,
+         sigLearnInstance.getFeatureMatrix, data, subjectIndex)
+   # separate passes group columns by feature rather than by channel
+   labels = tasks[0].chanLabels
+   separateNames = sum([features.featureNames(labels, [feature])
+                        for feature in features.FEATURES], [])
+   order = [separateNames.index(name) for name in features.featureNames(labels)]
+   assert(numpy.allclose(separate[:, order], sample, equal_nan = True))
+   for name in ['RMS loop', 'getRmsList', 'pass per feature', 'getFeatureMatrix']:
+      print "{0:18} {1:.4f}s".format(name, timings[name])
+   return timings
+
+def benchProjection(data, bins = 32, components = 3, subjectIndex = None, repeats = 3):
+   """
+   Compares the PCA solvers, and exact against Nystroem approximated kernel
+   PCA, on the spectral features of data. Returns a dict of timings in
+   seconds.
+   """
+   sample, classes = sigLearn.SignalLearn().getSpectralDecompArray(data, bins, subjectIndex)
+   projections = [('PCA full', projection.PCA(components, 'full')),
+                  ('PCA randomized', projection.PCA(components, 'randomized')),
+                  ('PCA incremental', projection.PCA(components, 'incremental')),
+                  ('KernelPCA exact', projection.KernelPCA(components, landmarks = None)),
+                  ('KernelPCA Nystroem', projection.KernelPCA(components, landmarks = 500))]
+   timings = {}
+   for name, projector in projections:
+      timings[name], embedding = _bestOf(repeats, projector.fit_transform, sample)
+   print "{0} epochs, {1} features".format(len(sample), sample[0].size)
+   for name, projector in projections:
+      print "{0:20} {1:.4f}s".format(name, timings[name])
+   return timings
+
+def benchLeaveOneOut(data, bins = 32, subjectIndex = 0, learners = None):
+   """
+   Checks the closed-form looPredict of each least-squares learner against
+   refitting it without each example in turn, on the unscaled spectral
+   features of data (by default ridge, and kernel ridge with each kernel).
+   Returns a dict of (refit, looPredict) timings in seconds.
+   """
+   if learners == None:
+      learners = [('Ridge', leastSquares.RidgeClassifier()),
+                  ('KernelRidge rbf', leastSquares.KernelRidgeClassifier()),
+                  ('KernelRidge linear', leastSquares.KernelRidgeClassifier(kernel = 'linear')),
+                  ('KernelRidge poly', leastSquares.KernelRidgeClassifier(kernel = 'poly'))]
+   sample, classes = sigLearn.SignalLearn().getSpectralDecompArray(data, bins, subjectIndex)
+   sample = sample.reshape((len(sample), -1))
+   def refit(learner):
+      results = numpy.zeros(len(sample), dtype = classes.dtype)
+      for index in range(len(sample)):
+         train = numpy.arange(len(sample)) != index
+         learner.fit(sample[train], classes[train])
+         results[index] = learner.predict(sample[index:index + 1])[0]
+      return results
+   timings = {}
+   for name, learner in learners:
+      refitTime, refitResults = _bestOf(1, refit, learner)
+      looTime, looResults = _bestOf(1, learner.looPredict, sample, classes)
+      assert(numpy.array_equal(refitResults, looResults))
+      timings[name] = refitTime, looTime
+      print "{0:20} refit {1:.4f}s, looPredict {2:.4f}s ({3:.1f}x)".format(name, refitTime,
+            looTime, refitTime / looTime)
+   return timings
+
+def _copyingCrossVal(sample, classes, learner, classifier, crossValMatrix):
+   """
+   Cross-validation with each fold's training and test sets materialised by
+   fancy indexing, as SignalLearn._crossVal used to.
+   """
+   results = numpy.zeros(len(sample))
+   for trainIndex, testIndex in crossValMatrix:
+      trainSample = sample[trainIndex]
+      learner(trainSample.reshape((len(trainSample), -1)), classes[trainIndex])
+      testSample = sample[testIndex]
+      results[testIndex] = classifier(testSample.reshape((len(testSample), -1)))
+   return results
+
+def benchFoldMemory(examples = 800, features = 2048, k = 10):
+   """
+   Compares the time and peak RSS of leave-one-out and stratified k-fold
+   validation of a cheap learner (online.NearestCentroid) on a random
+   [examples, features] sample, with folds materialised by fancy indexing
+   against SignalLearn's reused training buffer.
+   Returns a dict of (seconds, peak RSS in MB) pairs.
+   """
+   random = numpy.random.RandomState(0)
+   sample = random.standard_normal((examples, features))
+   classes = numpy.arange(examples) % 4
+   learner = online.NearestCentroid()
+   sigLearnInstance = sigLearn.SignalLearn(instrumentation = instrument.Recorder(quiet = True))
+   validators = [('leaveOneOut', cross_val.LeaveOneOut(examples)),
+                 ('stratifiedKFold', cross_val.StratifiedKFold(classes, k))]
+
+   results = {}
+   # measured first, so that neither inherits memory left over from the checks
+   for name, crossValMatrix in validators:
+      results[name + ' copying'] = _measured(_copyingCrossVal, sample, classes, learner.fit,
+            learner.predict, crossValMatrix)
+      results[name + ' buffered'] = _measured(sigLearnInstance._crossVal, sample, classes,
+            learner.fit, learner.predict, crossValMatrix, len(crossValMatrix))
+   for name, crossValMatrix in validators:
+      copying = _copyingCrossVal(sample, classes, learner.fit, learner.predict, crossValMatrix)
+      buffered, classAccuracies = sigLearnInstance._crossVal(sample, classes, learner.fit,
+            learner.predict, crossValMatrix, len(crossValMatrix))
+      assert(numpy.array_equal(copying, buffered))
+
+   print "{0:.1f}MB sample".format(sample.nbytes / 2.**20)
+   for name in sorted(results):
+      elapsed, peak = results[name]
+      print "{0:28} {1:.2f}s, peak RSS {2:.0f}MB".format(name, elapsed, peak)
+   return results
+
+def benchIngestion(subjects = 8, channels = 14, sampleRate = 128, seconds = 300, workers = 4):
+   """
+   Compares loading a synthetic ALLEEG file with ExperimentData and saving it
+   with saveCache, against convertMat.ingest from the same file and from
+   per-recording files across workers processes. Ingesting the ALLEEG file
+   reads it whole in one process, so only the per-recording run should
+   lower the peak RSS.
+   Returns a dict of (seconds, peak RSS in MB) pairs.
+   """
+   directory = tempfile.mkdtemp()
+   try:
+      alleegFile = os.path.join(directory, 'alleeg.mat')
+      synthetic.writeAlleeg(alleegFile, subjects, channels, sampleRate, seconds)
+      recordFiles = synthetic.writeRecordFiles(os.path.join(directory, 'records'),
+            subjects, channels, sampleRate, seconds)
+      megabytes = os.path.getsize(alleegFile) / 2.**20
+
+      def loadAndSave():
+         convert.ExperimentData(alleegFile).saveCache(os.path.join(directory, 'saved'))
+      results = {}
+      results['ExperimentData + saveCache'] = _measured(loadAndSave)
+      results['ingest ALLEEG'] = _measured(convert.ingest, alleegFile,
+            os.path.join(directory, 'alleeg'))
+      results['ingest files x{0}'.format(workers)] = _measured(convert.ingest, recordFiles,
+            os.path.join(directory, 'files'), workers)
+   finally:
+      shutil.rmtree(directory)
+
+   print "{0:.1f}MB synthetic ALLEEG".format(megabytes)
+   for name in sorted(results):
+      elapsed, peak = results[name]
+      print "{0:28} {1:.2f}s ({2:.1f}MB/s), peak RSS {3:.0f}MB".format(name, elapsed,
+            megabytes / elapsed, peak)
+   return results
+
+def _dataBytes(data):
+   """
+   Returns the bytes of sample data held by the recordings of data.
+   """
+   total = 0
+   for subject in data.matrix:
+      for task in subject:
+         if task != None:
+            samples = task.source if task.source is not None else task.data
+            total += samples.nbytes
+   return total
+
+def benchCompact(data, bins, model = None, subjectIndex = None, k = 5, repeats = 3):
+   """
+   Compares data against a compact (float32) copy of it: the memory held by
+   their samples, the time taken to extract spectral features, the largest
+   relative difference between the features, and the stratified k-fold
+   accuracy of model (by default a RidgeClassifier) on each. Fails if the
+   compact features differ by more than float32 precision allows, or the
+   accuracies by more than one fold's worth of examples.
+   Returns a dict of results.
+   """
+   if model == None:
+      model = leastSquares.RidgeClassifier()
+   compactData = copy.deepcopy(data)
+   compactData.compact()
+   sigLearnInstance = sigLearn.SignalLearn()
+   results = {}
+   for name, dataset in [('float64', data), ('float32', compactData)]:
+      elapsed, (sample, classes) = _bestOf(repeats,
+            sigLearnInstance.getSpectralDecompArray, dataset, bins, subjectIndex)
+      flat = sample.reshape((len(sample), -1))
+      resultsVector, accuracy, classAccuracy = sigLearnInstance.stratifiedKFoldVal(flat,
+            classes, model.fit, model.predict, k)
+      results[name] = {'bytes': _dataBytes(dataset), 'seconds': elapsed,
+                       'accuracy': accuracy, 'sample': sample}
+
+   reference, compact = results['float64'].pop('sample'), results['float32'].pop('sample')
+   scale = numpy.abs(reference).max()
+   results['maxRelativeError'] = numpy.abs(compact - reference).max() / scale
+   assert(results['maxRelativeError'] < 1e-4)
+   assert(abs(results['float64']['accuracy'] - results['float32']['accuracy'])
+          <= float(k) / len(classes))
+   for name in ['float64', 'float32']:
+      print "{0}: {1:.1f}MB, features in {2:.4f}s, accuracy {3:.3f}".format(name,
+            results[name]['bytes'] / 2.**20, results[name]['seconds'], results[name]['accuracy'])
+   print "max relative feature difference: {0:.2e}".format(results['maxRelativeError'])
+   return results
+
+def benchSweep(data, grid, workers = 4):
+   """
+   Compares looping testModules.runSpectralCrossValidation over a sweep.runSweep
+   grid (with stratified k-fold) against runSweep itself, serially and across
+   workers processes, checking that they report the same accuracies for
+   deterministic learners. Returns a dict of timings in seconds.
+   """
+   sigLearnInstance = sigLearn.SignalLearn()
+   directory = tempfile.mkdtemp()
+   timings = {}
+   try:
+      loop = {}
+      start = time.time()
+      for bins in grid['bins']:
+         for name, learner in grid['learners'].items():
+            for k in grid.get('k', [10]):
+               loop[('stratified', bins, name, k)] = testModules.runSpectralCrossValidation(
+                     data, bins, learner, sigLearnInstance.stratifiedKFoldVal, k)
+      timings['runSpectralCrossValidation'] = time.time() - start
+      for name, jobWorkers in [('runSweep', 1), ('runSweep x{0}'.format(workers), workers)]:
+         resultsFile = os.path.join(directory, '{0}.jsonl'.format(jobWorkers))
+         start = time.time()
+         sweep.runSweep(data, grid, resultsFile, workers = jobWorkers)
+         timings[name] = time.time() - start
+         summary = sweep.summarise(resultsFile)
+         for config, (perSubjectAccuracy, classAccuracies) in loop.items():
+            if not numpy.allclose(perSubjectAccuracy, summary[config]['perSubjectAccuracy']):
+               print "Warning: {0} accuracies differ for {1}".format(name, config)
+   finally:
+      shutil.rmtree(directory)
+
+   for name in sorted(timings):
+      print "{0:28} {1:.2f}s".format(name, timings[name])
+   return timings
+
+def _residentMB():
+   """
+   Returns the current resident set size of this process in MB.
+   """
+   pages = int(open('/proc/self/statm').read().split()[1])
+   return pages * os.sysconf('SC_PAGE_SIZE') / 2.**20
+
+def _stage(stages, name, repeats, function, *args):
+   """
+   Measures function(*args) repeats times with _measured, appending its
+   fastest time, largest peak RSS, and the largest rise in RSS over that of
+   this process (the memory allocated by the stage itself) to stages.
+   A failing stage is recorded with its error rather than ending the suite.
+   """
+   baseline = _residentMB()
+   try:
+      runs = [_measured(function, *args) for repeat in range(repeats)]
+   except RuntimeError, error:
+      stages.append({'stage': name, 'error': str(error)})
+      print "{0:28} failed".format(name)
+      return
+   seconds = min([elapsed for elapsed, peak in runs])
+   peak = max([peak for elapsed, peak in runs])
+   stages.append({'stage': name, 'seconds': seconds, 'peakMB': peak,
+                  'allocatedMB': max(0., peak - baseline)})
+   print "{0:28} {1:.4f}s, peak RSS {2:.0f}MB (+{3:.0f}MB)".format(name, seconds, peak,
+         max(0., peak - baseline))
+
+def runSuite(outputFile = None, subjects = 4, channels = 14, sampleRate = 128, epochs = 120,
+             epochSize = 1, conditions = 4, bins = 16, k = 10, workers = 1, repeats = 3,
+             learner = None):
+   """
+   Times and memory-profiles each stage of the pipeline on a synthetic
+   dataset of subjects x conditions recordings of epochs epochs each:
+   ingestion of per-recording files into the .npy cache, splitEpochs,
+   getRmsList, getFeatureMatrix, getSpectralDecomp(Array), each cross-validator and the
+   metrics. Cross-validation uses the first subject's spectral features and
+   learner (by default a leastSquares.RidgeClassifier, which is
+   deterministic). Every stage runs in a child process (see _measured), so
+   stages do not affect each other's memory use or state.
+
+   Returns a dict of the parameters, environment and per-stage results,
+   which is also written to outputFile as JSON if one is given.
+   """
+   if learner == None:
+      learner = leastSquares.RidgeClassifier()
+   parameters = {'subjects': subjects, 'channels': channels, 'sampleRate': sampleRate,
+                 'epochs': epochs, 'epochSize': epochSize, 'conditions': conditions,
+                 'bins': bins, 'k': k, 'workers': workers, 'repeats': repeats,
+                 'learner': repr(learner)}
+   environment = {'python': platform.python_version(), 'numpy': numpy.__version__,
+                  'platform': platform.platform(), 'time': time.strftime("%Y-%m-%d %H:%M:%S")}
+   stages = []
+
+   directory = tempfile.mkdtemp()
+   try:
+      recordFiles = synthetic.writeRecordFiles(os.path.join(directory, 'records'), subjects,
+            channels, sampleRate, epochs * epochSize, conditions)
+      _stage(stages, 'ingest', repeats, convert.ingest, recordFiles,
+             os.path.join(directory, 'cache'), workers)
+   finally:
+      shutil.rmtree(directory)
+
+   data = synthetic.makeExperimentData(subjects, channels, sampleRate, epochs, epochSize,
+                                       conditions)
+   def splitEpochs():
+      for subject in data.matrix:
+         for task in subject:
+            task.splitEpochs(epochSize)
+   _stage(stages, 'splitEpochs', repeats, splitEpochs)
+   splitEpochs()
+
+   sigLearnInstance = sigLearn.SignalLearn()
+   _stage(stages, 'getRmsList', repeats, sigLearnInstance.getRmsList, data)
+   _stage(stages, 'getFeatureMatrix', repeats, sigLearnInstance.getFeatureMatrix, data)
+   _stage(stages, 'getSpectralDecomp', repeats, sigLearnInstance.getSpectralDecomp, data, bins)
+   _stage(stages, 'getSpectralDecompArray', repeats, sigLearnInstance.getSpectralDecompArray,
+          data, bins)
+
+   sample, classes = sigLearnInstance.getSpectralDecompArray(data, bins, 0)
+   sample = sample.reshape((len(sample), -1))
+   _stage(stages, 'kFoldVal', repeats, sigLearnInstance.kFoldVal, sample, classes,
+          learner.fit, learner.predict, k, workers)
+   _stage(stages, 'stratifiedKFoldVal', repeats, sigLearnInstance.stratifiedKFoldVal, sample,
+          classes, learner.fit, learner.predict, k, workers)
+   _stage(stages, 'leaveOneOut', repeats, sigLearnInstance.leaveOneOut, sample, classes,
+          learner.fit, learner.predict, workers)
+   if hasattr(learner, 'looPredict'):
+      _stage(stages, 'leaveOneOut fast', repeats, sigLearnInstance.leaveOneOut, sample, classes,
+             learner.fit, learner.predict, workers, False, True)
+
+   results, accuracy, classAccuracy = sigLearnInstance.stratifiedKFoldVal(sample, classes,
+         learner.fit, learner.predict, k)
+   def computeMetrics():
+      confusion = metrics.confusionMatrix(results, classes)
+      metrics.accuracy(confusion)
+      metrics.classAccuracy(confusion)
+      perSubjectAccuracy = numpy.repeat(accuracy, subjects)
+      metrics.subjectSummary(perSubjectAccuracy, numpy.tile(classAccuracy, (subjects, 1)))
+   _stage(stages, 'metrics', repeats, computeMetrics)
+
+   report = {'parameters': parameters, 'environment': environment, 'stages': stages}
+   if outputFile != None:
+      json.dump(report, open(outputFile, 'w'), indent = 1)
+   return report
+
+def main(*args):
+   parser = argparse.ArgumentParser(
+         description = 'Benchmark every pipeline stage on synthetic data, as JSON.')
+   parser.add_argument('--output', default = None, help = 'JSON results file')
+   parser.add_argument('--subjects', type = int, default = 4)
+   parser.add_argument('--channels', type = int, default = 14)
+   parser.add_argument('--sampleRate', type = int, default = 128)
+   parser.add_argument('--epochs', type = int, default = 120,
+         help = 'epochs per recording')
+   parser.add_argument('--epochSize', type = float, default = 1, help = 'seconds per epoch')
+   parser.add_argument('--conditions', type = int, default = 4)
+   parser.add_argument('--bins', type = int, default = 16)
+   parser.add_argument('-k', type = int, default = 10, help = 'folds for k-fold validation')
+   parser.add_argument('--workers', type = int, default = 1)
+   parser.add_argument('--repeats', type = int, default = 3)
+   argsParsed = parser.parse_args(args[1:])
+
+   runSuite(argsParsed.output, argsParsed.subjects, argsParsed.channels, argsParsed.sampleRate,
+            argsParsed.epochs, argsParsed.epochSize, argsParsed.conditions, argsParsed.bins,
+            argsParsed.k, argsParsed.workers, argsParsed.repeats)
+
+if __name__ == "__main__":
+   main(*sys.argv)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Content-addressed cache for per-recording feature arrays, so that repeated
+experiments over different learners or validation settings do not recompute
+the same spectral or RMS features.
+
+Entries are keyed on a hash of the recording (its metadata, epoch layout and
+sample data) together with the feature type and its parameters. Any change to
+a TaskRecording's data or to its splitEpochs layout therefore produces a new
+key, and stale entries are simply never looked up again. Recently used
+entries are kept in memory up to a byte budget; if a directory is given every
+entry is also written there, so it survives eviction and later sessions.
+"""
+
+import os
+import hashlib
+import weakref
+import collections
+import numpy
+
+class FeatureCache:
+
+   def __init__(self, maxBytes = 256 * 2**20, directory = None):
+      self.maxBytes = maxBytes
+      self.directory = directory
+      if directory != None and not os.path.isdir(directory):
+         os.makedirs(directory)
+      self.hits = 0
+      self.diskHits = 0
+      self.misses = 0
+      self._entries = collections.OrderedDict()
+      self._bytes = 0
+      # id(data array) -> (weak reference to the array, digest of its contents)
+      self._digests = {}
+
+   def _dataDigest(self, data):
+      """
+      Returns a digest of the contents of data, reusing the previous one if
+      the very same array object has been hashed before.
+      """
+      known = self._digests.get(id(data))
+      if known != None and known[0]() is data:
+         return known[1]
+      digest = hashlib.sha1()
+      for channel in data:
+         digest.update(numpy.ascontiguousarray(channel).data)
+      digest = digest.hexdigest()
+      self._digests[id(data)] = (weakref.ref(data), digest)
+      return digest
+
+   def key(self, task, featureType, **params):
+      """
+      Returns the cache key for features of featureType, computed with the
+      given parameters, from the TaskRecording task.
+      """
+      # split recordings are identified by their continuous source and layout
+      if task.source is None:
+         data = task.data
+      else:
+         data = task.source
+      if task.epochStep is None:
+         epochStep = None
+      else:
+         epochStep = float(task.epochStep)
+      identity = (int(task.subject), int(task.condition), float(task.sampleRate),
+                  float(task.epochSize), epochStep, int(task.nEpochs),
+                  tuple([int(size) for size in task.data.shape]), task.data.dtype.str,
+                  self._dataDigest(data), featureType, sorted(params.items()))
+      return hashlib.sha1(repr(identity)).hexdigest()
+
+   def _path(self, key):
+      return os.path.join(self.directory, key + '.npy')
+
+   def _remember(self, key, value):
+      if value.nbytes > self.maxBytes:
+         return
+      self._entries[key] = value
+      self._bytes += value.nbytes
+      while self._bytes > self.maxBytes:
+         evictedKey, evicted = self._entries.popitem(last = False)
+         self._bytes -= evicted.nbytes
+
+   def get(self, key):
+      """
+      Returns the array stored under key, or None if there is none.
+      """
+      if key in self._entries:
+         value = self._entries.pop(key)
+         # re-insert to mark as most recently used
+         self._entries[key] = value
+         self.hits += 1
+         return value
+      if self.directory != None and os.path.exists(self._path(key)):
+         value = numpy.load(self._path(key))
+         self._remember(key, value)
+         self.diskHits += 1
+         return value
+      self.misses += 1
+      return None
+
+   def put(self, key, value):
+      value = numpy.asanyarray(value)
+      if self.directory != None:
+         # written aside and renamed, so an interrupted write never leaves a
+         # truncated entry for get to trip over
+         temporary = '{0}.{1}.tmp'.format(self._path(key), os.getpid())
+         with open(temporary, 'wb') as output:
+            numpy.save(output, value)
+         os.rename(temporary, self._path(key))
+      if key in self._entries:
+         self._bytes -= self._entries.pop(key).nbytes
+      self._remember(key, value)
+
+   def fetch(self, task, featureType, compute, **params):
+      """
+      Returns the cached features of featureType for task, calling
+      compute(task) to produce (and store) them on a miss.
+      """
+      key = self.key(task, featureType, **params)
+      value = self.get(key)
+      if value is None:
+         value = compute(task)
+         self.put(key, value)
+      return value
+
+   def invalidate(self, task = None):
+      """
+      Forgets the remembered content digests, of task's data only if given.
+      Needed only if recording data is modified in place; replacing a
+      recording's data array (as splitEpochs does) is detected automatically.
+      """
+      if task == None:
+         self._digests.clear()
+      else:
+         self._digests.pop(id(task.data), None)
+         self._digests.pop(id(task.source), None)
+
+   def clear(self, disk = False):
+      """
+      Empties the in-memory cache, and the on-disk store too if disk is set.
+      """
+      self._entries.clear()
+      self._bytes = 0
+      if disk and self.directory != None:
+         for filename in os.listdir(self.directory):
+            if filename.endswith('.npy'):
+               os.remove(os.path.join(self.directory, filename))
+
+   def stats(self):
+      return {'hits': self.hits, 'diskHits': self.diskHits, 'misses': self.misses,
+              'entries': len(self._entries), 'bytes': self._bytes}
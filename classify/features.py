@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Time domain and band power features of every channel of every epoch,
+computed together in a single pass over the raw data.
+
+The epochs are processed a chunk at a time: each chunk is converted to
+float64 once, and every feature is derived from that copy (and from its
+first and second differences and periodogram) while it is still in cache,
+instead of scanning the whole recording once per feature type. Features are:
+   rms        - root sum of squares, as SignalLearn.getRmsList and spectrum.RMS
+   variance   - variance of the samples (Hjorth activity)
+   lineLength - sum of the absolute differences between consecutive samples
+   mobility   - Hjorth mobility, sqrt(var(x') / var(x))
+   complexity - Hjorth complexity, mobility(x') / mobility(x)
+   bandPower  - power in each frequency band (see spectrum.bandIndices), from
+                the periodogram of the mean-removed epoch
+"""
+
+import numpy
+import spectrum
+
+FEATURES = ['rms', 'variance', 'lineLength', 'mobility', 'complexity', 'bandPower']
+
+def _bandNames(bands):
+   if len(bands) and numpy.isscalar(bands[0]):
+      return ['{0}-{1}Hz'.format(low, high) for low, high in zip(bands[:-1], bands[1:])]
+   return [name for name, band in bands]
+
+def featureNames(chanLabels, features = FEATURES, bands = spectrum.EEG_BANDS):
+   """
+   Returns the name of each column of the matrix returned by epochFeatures,
+   e.g. 'C1:rms' or 'C1:alpha', for channels with the given labels.
+   """
+   names = []
+   for label in chanLabels:
+      for feature in features:
+         if feature == 'bandPower':
+            names.extend(['{0}:{1}'.format(label, band) for band in _bandNames(bands)])
+         else:
+            names.append('{0}:{1}'.format(label, feature))
+   return names
+
+def _chunkFeatures(chunk, sampleRate, features, bands):
+   """
+   Returns the [epoch, channel, feature] features of a [epoch, channel,
+   sample] float64 chunk.
+   """
+   length = chunk.shape[-1]
+   columns = []
+   centred = chunk - chunk.mean(axis = -1)[..., numpy.newaxis]
+   variance = numpy.einsum('...i,...i->...', centred, centred) / length
+   if 'mobility' in features or 'complexity' in features or 'lineLength' in features:
+      first = numpy.diff(chunk, axis = -1)
+   if 'mobility' in features or 'complexity' in features:
+      firstVariance = first.var(axis = -1)
+      with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+         mobility = numpy.sqrt(firstVariance / variance)
+   for feature in features:
+      if feature == 'rms':
+         columns.append(numpy.sqrt(numpy.einsum('...i,...i->...', chunk, chunk)))
+      elif feature == 'variance':
+         columns.append(variance)
+      elif feature == 'lineLength':
+         columns.append(numpy.abs(first).sum(axis = -1))
+      elif feature == 'mobility':
+         columns.append(mobility)
+      elif feature == 'complexity':
+         secondVariance = numpy.diff(first, axis = -1).var(axis = -1)
+         with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+            columns.append(numpy.sqrt(secondVariance / firstVariance) / mobility)
+      elif feature == 'bandPower':
+         power = numpy.square(numpy.abs(numpy.fft.rfft(centred, axis = -1)))
+         psd = spectrum._oneSidedDensity(power, length, 1. / (sampleRate * length))
+         freqs = spectrum.frequencies(length, sampleRate)
+         starts, stops = spectrum.bandIndices(freqs, bands)
+         # integrate the density over each band
+         bandPower = spectrum.bandPower(psd, starts, stops) * (freqs[1] - freqs[0])
+         columns.extend(numpy.rollaxis(bandPower, -1))
+      else:
+         raise ValueError("features must be among {0}".format(FEATURES))
+   return numpy.concatenate([column[..., numpy.newaxis] for column in columns], axis = -1)
+
+def epochFeatures(epochs, sampleRate, features = FEATURES, bands = spectrum.EEG_BANDS,
+                  chunkSize = 64):
+   """
+   Returns the [epoch, channel * feature] matrix of the given features (see
+   FEATURES) of a [epoch, channel, sample] array or view of epochs, such as
+   SignalLearn._epochView returns, with columns ordered as featureNames.
+   Epochs are processed chunkSize at a time.
+   """
+   epochs = numpy.asanyarray(epochs)
+   result = None
+   for start in range(0, len(epochs), chunkSize):
+      chunk = numpy.ascontiguousarray(epochs[start:start + chunkSize], dtype = numpy.float64)
+      values = _chunkFeatures(chunk, sampleRate, features, bands)
+      values = values.reshape((len(values), -1))
+      if result is None:
+         result = numpy.empty((len(epochs), values.shape[1]))
+      result[start:start + len(values)] = values
+   return result
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Instrumentation hooks for SignalLearn. Timed stages (feature extraction,
+array copies, and each fold's fit, predict and scoring), counters and
+progress reports are passed to an instrument, given as
+SignalLearn(instrumentation = ...).
+
+The default, Instrument, is a null object: stages and counters cost a method
+call and nothing more, and progress is printed as it always has been. A
+Recorder instead accumulates per-stage totals and passes each event, as a
+dict, to a callback and/or writes it to a log file as a line of JSON.
+It can also profile chosen stages with cProfile, and record their peak
+memory use, e.g.:
+   recorder = instrument.Recorder(log = open('run.jsonl', 'w'), profile = ['fit'])
+   sigLearnInstance = sigLearn.SignalLearn(instrumentation = recorder)
+   ...
+   recorder.report()
+   recorder.profiles['fit'].sort_stats('cumulative').print_stats(20)
+
+Stages run by forked cross-validation workers are recorded in a buffer (see
+Instrument.buffer) which is sent back with the fold's results and replayed
+into the parent's instrument, so parallel runs report the same events as
+serial ones. Profiles and memory figures are only gathered in the parent,
+so per-fold stages are only profiled and measured in serial runs.
+"""
+
+import cProfile
+import pstats
+import resource
+import json
+import time
+try:
+   import tracemalloc
+except ImportError:
+   tracemalloc = None
+
+class _NullStage(object):
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exception):
+      return False
+
+_NULL_STAGE = _NullStage()
+
+class Instrument(object):
+   """
+   The null instrument: records nothing and prints progress to stdout.
+   """
+
+   def stage(self, name, **info):
+      """
+      Returns a context manager timing the stage name, with any keyword
+      arguments recorded alongside it (e.g. fold = 3).
+      """
+      return _NULL_STAGE
+
+   def count(self, name, amount = 1, **info):
+      """
+      Adds amount to the counter name, e.g. the number of bytes copied.
+      """
+      pass
+
+   def message(self, text):
+      print text
+
+   def progress(self, done, total):
+      print "{0}: {1}/{2} done".format(time.strftime("%H:%M:%S"), done, total)
+
+   def buffer(self):
+      """
+      Returns an instrument for work done in another process, whose events
+      are returned by its drain method and passed to replay here.
+      """
+      return self
+
+   def drain(self):
+      return None
+
+   def replay(self, events):
+      pass
+
+class _Stage(object):
+
+   def __init__(self, recorder, name, info):
+      self.recorder = recorder
+      self.name = name
+      self.info = info
+      self.profiler = None
+
+   def __enter__(self):
+      recorder = self.recorder
+      if recorder.memory:
+         if tracemalloc != None:
+            if not tracemalloc.is_tracing():
+               tracemalloc.start()
+            self.memoryStart = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+               tracemalloc.reset_peak()
+         else:
+            self.memoryStart = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      if recorder._profiling(self.name):
+         self.profiler = cProfile.Profile()
+         recorder._activeProfiler = self.profiler
+         self.profiler.enable()
+      self.start = time.time()
+      return self
+
+   def __exit__(self, *exception):
+      elapsed = time.time() - self.start
+      recorder = self.recorder
+      if self.profiler != None:
+         self.profiler.disable()
+         recorder._activeProfiler = None
+         recorder._addProfile(self.name, self.profiler)
+      event = dict(self.info)
+      if recorder.memory:
+         if tracemalloc != None:
+            event['peakBytes'] = tracemalloc.get_traced_memory()[1] - self.memoryStart
+         else:
+            # ru_maxrss is in kilobytes on Linux, and only rises past the
+            # process's previous peak
+            event['peakBytes'] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                  - self.memoryStart) * 1024
+      event.update({'event': 'stage', 'name': self.name, 'seconds': elapsed})
+      recorder._emit(event)
+      return False
+
+class Recorder(Instrument):
+   """
+   Records stage timings and counters, passing each event to callback (if
+   given) and writing it to the file-like log (if given) as a line of JSON.
+
+   profile is a list of stage names (or True for every stage) to run under
+   cProfile; their accumulated pstats.Stats are kept in self.profiles.
+   Stages nested within a profiled stage are not profiled separately.
+   With memory set, each stage event includes peakBytes, the peak memory
+   allocated during the stage according to tracemalloc where available, or
+   else the rise in the process's peak RSS (so only stages that set a new
+   peak report any).
+
+   Progress is printed as by Instrument unless quiet is set; either way it
+   is recorded as an event.
+   """
+
+   def __init__(self, callback = None, log = None, profile = (), memory = False, quiet = False):
+      self.callback = callback
+      self.log = log
+      self.profile = profile
+      self.memory = memory
+      self.quiet = quiet
+      self.profiles = {}
+      self._activeProfiler = None
+      self.reset()
+
+   def reset(self):
+      """
+      Clears the accumulated totals and counters.
+      """
+      # stage name -> [calls, seconds]
+      self.totals = {}
+      self.counters = {}
+
+   def _profiling(self, name):
+      if self._activeProfiler != None:
+         return False
+      return self.profile is True or name in self.profile
+
+   def _addProfile(self, name, profiler):
+      if name in self.profiles:
+         self.profiles[name].add(profiler)
+      else:
+         self.profiles[name] = pstats.Stats(profiler)
+
+   def _emit(self, event):
+      event.setdefault('time', time.time())
+      if event['event'] == 'stage':
+         total = self.totals.setdefault(event['name'], [0, 0.])
+         total[0] += 1
+         total[1] += event['seconds']
+      elif event['event'] == 'count':
+         self.counters[event['name']] = self.counters.get(event['name'], 0) + event['amount']
+      if self.callback != None:
+         self.callback(event)
+      if self.log != None:
+         self.log.write(json.dumps(event, default = repr) + '\n')
+
+   def stage(self, name, **info):
+      return _Stage(self, name, info)
+
+   def count(self, name, amount = 1, **info):
+      info.update({'event': 'count', 'name': name, 'amount': amount})
+      self._emit(info)
+
+   def message(self, text):
+      if not self.quiet:
+         Instrument.message(self, text)
+      self._emit({'event': 'message', 'text': text})
+
+   def progress(self, done, total):
+      if not self.quiet:
+         Instrument.progress(self, done, total)
+      self._emit({'event': 'progress', 'done': done, 'total': total})
+
+   def buffer(self):
+      return _Buffer()
+
+   def replay(self, events):
+      for event in events:
+         self._emit(event)
+
+   def summary(self):
+      """
+      Returns a dict of the calls, total seconds and mean seconds of each
+      stage, and a dict of the counters.
+      """
+      stages = dict([(name, {'calls': calls, 'seconds': seconds, 'mean': seconds / calls})
+                     for name, (calls, seconds) in self.totals.items()])
+      return stages, dict(self.counters)
+
+   def report(self):
+      """
+      Prints the stage totals, slowest first, and the counters.
+      """
+      stages, counters = self.summary()
+      for name in sorted(stages, key = lambda name: -stages[name]['seconds']):
+         print "{0:24} {1:8d} calls {2:10.4f}s ({3:.6f}s each)".format(name,
+               stages[name]['calls'], stages[name]['seconds'], stages[name]['mean'])
+      for name in sorted(counters):
+         print "{0:24} {1}".format(name, counters[name])
+
+class _Buffer(Recorder):
+   """
+   Keeps the events of work done in a worker process, to be replayed by the
+   parent's Recorder.
+   """
+
+   def __init__(self):
+      Recorder.__init__(self, quiet = True)
+      self.events = []
+
+   def _emit(self, event):
+      event.setdefault('time', time.time())
+      self.events.append(event)
+
+   def buffer(self):
+      return self
+
+   def drain(self):
+      events = self.events
+      self.events = []
+      return events
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Regularised least-squares classifiers, in primal (linear ridge) and dual
+(kernel ridge) form. They follow the scikits.learn fit/predict interface and
+also provide looPredict, which returns every leave-one-out prediction from a
+single fit using the hat matrix identity: for a penalised least-squares fit
+with hat matrix H, the prediction for example i of the model trained without
+it is (y'_i - H_ii y_i) / (1 - H_ii), where y'_i is the full model's
+prediction. KernelRidgeClassifier uses the equivalent form built from the
+off-diagonal kernel values, which stays accurate when they are tiny.
+SignalLearn.leaveOneOut(..., fast = True) uses both.
+
+Multiple classes are handled one-vs-rest, with +1/-1 target columns for each
+class present in the training set, and the class with the largest response
+is predicted.
+"""
+
+import numpy
+import scipy.linalg
+
+def kernelMatrix(left, right, kernel = 'rbf', gamma = None, degree = 3, coef0 = 1):
+   """
+   Returns the [left example, right example] matrix of kernel ('linear',
+   'rbf' or 'poly', as for KernelRidgeClassifier) values between the rows of
+   two 2D arrays. gamma defaults to 1 / features.
+   """
+   if gamma == None:
+      gamma = 1. / left.shape[1]
+   products = numpy.dot(left, right.T)
+   if kernel == 'linear':
+      return products
+   elif kernel == 'poly':
+      return (gamma * products + coef0) ** degree
+   elif kernel == 'rbf':
+      distances = (numpy.square(left).sum(axis = 1)[:, numpy.newaxis] - 2 * products
+                   + numpy.square(right).sum(axis = 1))
+      return numpy.exp(-gamma * numpy.maximum(distances, 0))
+   else:
+      raise ValueError("kernel must be one of 'linear', 'rbf' or 'poly'")
+
+class _LeastSquaresClassifier:
+
+   def _targets(self, classes):
+      self.labels = numpy.unique(classes)
+      targets = -numpy.ones((len(classes), len(self.labels)))
+      targets[numpy.arange(len(classes)), numpy.searchsorted(self.labels, classes)] = 1
+      return targets
+
+   def _decide(self, responses):
+      return self.labels[responses.argmax(axis = 1)]
+
+   def _looResponses(self, responses, hat, targets):
+      hat = hat[:, numpy.newaxis]
+      return (responses - hat * targets) / (1 - hat)
+
+class RidgeClassifier(_LeastSquaresClassifier):
+   """
+   Linear least-squares classifier with an L2 penalty of alpha on the
+   weights (but not on the intercept, if fitIntercept is set).
+   """
+
+   def __init__(self, alpha = 1.0, fitIntercept = True):
+      self.alpha = alpha
+      self.fitIntercept = fitIntercept
+
+   def _design(self, sample):
+      sample = numpy.asanyarray(sample, dtype = float)
+      sample = sample.reshape((len(sample), -1))
+      if self.fitIntercept:
+         return numpy.hstack((sample, numpy.ones((len(sample), 1))))
+      return sample
+
+   def _factorise(self, design):
+      gram = numpy.dot(design.T, design)
+      penalty = numpy.ones(design.shape[1]) * self.alpha
+      if self.fitIntercept:
+         penalty[-1] = 0
+      gram[numpy.diag_indices_from(gram)] += penalty
+      return scipy.linalg.cho_factor(gram)
+
+   def fit(self, sample, classes):
+      design = self._design(sample)
+      targets = self._targets(classes)
+      self.coef_ = scipy.linalg.cho_solve(self._factorise(design), numpy.dot(design.T, targets))
+      return self
+
+   def predict(self, sample):
+      return self._decide(numpy.dot(self._design(sample), self.coef_))
+
+   def looPredict(self, sample, classes):
+      """
+      Returns the leave-one-out prediction for every example of sample, from
+      a single factorisation. Also leaves the model fitted to the whole set.
+      """
+      design = self._design(sample)
+      targets = self._targets(classes)
+      factor = self._factorise(design)
+      self.coef_ = scipy.linalg.cho_solve(factor, numpy.dot(design.T, targets))
+      # diagonal of design * gram^-1 * design.T
+      hat = (design * scipy.linalg.cho_solve(factor, design.T).T).sum(axis = 1)
+      return self._decide(self._looResponses(numpy.dot(design, self.coef_), hat, targets))
+
+class KernelRidgeClassifier(_LeastSquaresClassifier):
+   """
+   Kernel least-squares classifier with ridge penalty alpha. kernel is one of
+   'linear', 'rbf' (exp(-gamma |x - y|^2)) or 'poly'
+   ((gamma <x, y> + coef0) ^ degree); gamma defaults to 1 / features.
+   """
+
+   def __init__(self, alpha = 1.0, kernel = 'rbf', gamma = None, degree = 3, coef0 = 1):
+      self.alpha = alpha
+      self.kernel = kernel
+      self.gamma = gamma
+      self.degree = degree
+      self.coef0 = coef0
+
+   def _flat(self, sample):
+      sample = numpy.asanyarray(sample, dtype = float)
+      return sample.reshape((len(sample), -1))
+
+   def _kernel(self, left, right):
+      return kernelMatrix(left, right, self.kernel, self.gamma, self.degree, self.coef0)
+
+   def _factorise(self, gram):
+      gram = gram.copy()
+      gram[numpy.diag_indices_from(gram)] += self.alpha
+      return scipy.linalg.cho_factor(gram)
+
+   def fit(self, sample, classes):
+      self.support_ = self._flat(sample)
+      factor = self._factorise(self._kernel(self.support_, self.support_))
+      self.dual_coef_ = scipy.linalg.cho_solve(factor, self._targets(classes))
+      return self
+
+   def predict(self, sample):
+      return self._decide(numpy.dot(self._kernel(self._flat(sample), self.support_), self.dual_coef_))
+
+   def looPredict(self, sample, classes):
+      """
+      Returns the leave-one-out prediction for every example of sample, from
+      a single factorisation. Also leaves the model fitted to the whole set.
+      """
+      self.support_ = self._flat(sample)
+      gram = self._kernel(self.support_, self.support_)
+      targets = self._targets(classes)
+      factor = self._factorise(gram)
+      self.dual_coef_ = scipy.linalg.cho_solve(factor, targets)
+      # The hat matrix identity cancels catastrophically when the kernel's
+      # off-diagonal values are tiny (e.g. rbf on unscaled features), so the
+      # held-out responses are built from the off-diagonal terms alone:
+      # f_i = (K0 C)_i - c_i (K0 G^-1)_ii / G^-1_ii, with K0 the gram matrix
+      # without its diagonal and G = gram + alpha I.
+      inverse = scipy.linalg.cho_solve(factor, numpy.eye(len(gram)))
+      offDiagonal = gram.copy()
+      offDiagonal[numpy.diag_indices_from(offDiagonal)] = 0
+      correction = (offDiagonal * inverse).sum(axis = 1) / numpy.diag(inverse)
+      responses = (numpy.dot(offDiagonal, self.dual_coef_)
+                   - self.dual_coef_ * correction[:, numpy.newaxis])
+      return self._decide(responses)
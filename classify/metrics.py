@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Vectorised classification metrics. Everything is derived from confusion
+matrices, each built with a single bincount, so they are cheap enough to
+compute for every fold of a leave-one-out run.
+
+Classes absent from a set of examples have no defined accuracy, and are
+given NaN rather than 0 (or a value borrowed from another class), so that
+they can be left out of any later averaging.
+"""
+
+import numpy
+
+def confusionMatrix(results, classes, labels = None):
+   """
+   Returns the [true class x predicted class] count matrix of results against
+   the true classes, with rows and columns ordered as labels (by default
+   every value found in either, sorted). Predictions not among labels are
+   not counted.
+   """
+   results = numpy.asanyarray(results)
+   classes = numpy.asanyarray(classes)
+   if labels is None:
+      labels = numpy.union1d(numpy.unique(classes), numpy.unique(results))
+   labels = numpy.asanyarray(labels)
+   size = len(labels)
+   trueCodes, trueKnown = _codes(labels, classes)
+   resultCodes, resultKnown = _codes(labels, results)
+   known = trueKnown & resultKnown
+   counts = numpy.bincount(trueCodes[known] * size + resultCodes[known], minlength = size * size)
+   return counts.reshape((size, size))
+
+def _codes(labels, values):
+   """
+   Returns the index of each of values in the array labels (in any order),
+   and a mask of which values were found there at all.
+   """
+   order = numpy.argsort(labels, kind = 'mergesort')
+   sortedLabels = labels[order]
+   positions = numpy.minimum(numpy.searchsorted(sortedLabels, values), len(labels) - 1)
+   return order[positions], sortedLabels[positions] == values
+
+def accuracy(confusion):
+   """
+   Returns the fraction of correct classifications in a confusion matrix,
+   or 0 if it is empty.
+   """
+   total = confusion.sum()
+   if total == 0:
+      return 0
+   return float(numpy.trace(confusion)) / total
+
+def classAccuracy(confusion):
+   """
+   Returns the per-class accuracy (recall) of a confusion matrix, or of the
+   last two axes of a stack of them, with NaN for absent classes.
+   """
+   totals = confusion.sum(axis = -1)
+   correct = numpy.diagonal(confusion, axis1 = -2, axis2 = -1)
+   with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+      return numpy.true_divide(correct, totals)
+
+def foldSummary(foldClassAccuracies):
+   """
+   Given a [folds x classes] matrix of per-fold class accuracies, returns for
+   each class the fraction of the folds containing it in which most of its
+   examples were classified correctly (the rounded fold accuracy), as
+   reported by SignalLearn's cross-validators.
+   """
+   foldClassAccuracies = numpy.asanyarray(foldClassAccuracies, dtype = float)
+   present = ~numpy.isnan(foldClassAccuracies)
+   rounded = numpy.where(present, numpy.rint(foldClassAccuracies), 0)
+   with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+      return numpy.true_divide(rounded.sum(axis = 0), present.sum(axis = 0))
+
+def subjectSummary(perSubjectAccuracy, classAccuracies, chance = 0.5):
+   """
+   Summarises per-subject results, as returned by
+   testModules.runSpectralCrossValidation, ignoring NaN entries.
+   Returns a dict of the mean, standard deviation, minimum and maximum
+   subject accuracy, the mean accuracy of each class, and the fraction of
+   subject/class accuracies above chance.
+   """
+   perSubjectAccuracy = numpy.asanyarray(perSubjectAccuracy, dtype = float)
+   classAccuracies = numpy.asanyarray(classAccuracies, dtype = float)
+   subjects = perSubjectAccuracy[~numpy.isnan(perSubjectAccuracy)]
+   present = ~numpy.isnan(classAccuracies)
+   with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+      classMeans = numpy.true_divide(numpy.where(present, classAccuracies, 0).sum(axis = 0),
+                                     present.sum(axis = 0))
+   return {'mean':        subjects.mean(),
+           'std':         subjects.std(),
+           'min':         subjects.min(),
+           'max':         subjects.max(),
+           'classMeans':  classMeans,
+           'aboveChance': numpy.true_divide((classAccuracies[present] > chance).sum(),
+                                            present.sum())}
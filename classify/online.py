@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Learners supporting incremental training, for use with the incremental
+cross-validation mode of SignalLearn (kFoldVal(..., incremental = True) etc.).
+
+Besides the usual fit(sample, classes) and predict(sample), such learners
+provide partial_fit(sample, classes), which adds examples to the current
+model, and optionally downdate(sample, classes), which exactly removes
+examples previously added. fit must accept an empty sample and leave an
+untrained model, as cross-validation resets its copy of a learner that way.
+"""
+
+import numpy
+
+class NearestCentroid:
+   """
+   Classifies each example as the class with the nearest mean. The model is
+   just the per-class sums and counts of the training examples, so updates
+   and downdates are exact and cost only as much as the examples involved.
+   """
+
+   def __init__(self):
+      self._sums = {}
+      self._counts = {}
+
+   def _accumulate(self, sample, classes, sign):
+      sample = numpy.asanyarray(sample)
+      classes = numpy.asanyarray(classes)
+      for label in numpy.unique(classes):
+         rows = sample[classes == label]
+         if label not in self._sums:
+            self._sums[label] = numpy.zeros(rows.shape[1:])
+            self._counts[label] = 0
+         self._sums[label] += sign * rows.sum(axis = 0)
+         self._counts[label] += sign * len(rows)
+         if self._counts[label] == 0:
+            del self._sums[label], self._counts[label]
+
+   def partial_fit(self, sample, classes):
+      self._accumulate(sample, classes, 1)
+
+   def downdate(self, sample, classes):
+      self._accumulate(sample, classes, -1)
+
+   def fit(self, sample, classes):
+      self._sums = {}
+      self._counts = {}
+      self.partial_fit(sample, classes)
+
+   def predict(self, sample):
+      labels = sorted(self._sums.keys())
+      means = numpy.array([self._sums[label] / self._counts[label] for label in labels])
+      flat = numpy.asanyarray(sample).reshape((len(sample), -1))
+      distances = (numpy.square(flat).sum(axis = 1)[:, numpy.newaxis]
+                   - 2 * numpy.dot(flat, means.reshape((len(means), -1)).T)
+                   + numpy.square(means.reshape((len(means), -1))).sum(axis = 1))
+      return numpy.array(labels)[distances.argmin(axis = 1)]
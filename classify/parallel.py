@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Process pool helpers for spreading independent units of work, such as
+cross-validation folds or subjects, across cores.
+
+Workers are forked from the calling process and inherit its memory, so the
+shared context (sample arrays, learners, ExperimentData objects...) is handed
+over once, copy-on-write, rather than being pickled with every task. Only the
+per-task items and their results travel between processes. This relies on
+the fork start method, i.e. a POSIX platform.
+"""
+
+import multiprocessing
+
+# (function, context) pair inherited by forked workers
+_shared = None
+
+def _apply(item):
+   function, context = _shared
+   return function(context, item)
+
+def forkMap(function, context, items, workers = 1, ordered = True, chunkSize = 1):
+   """
+   Yields function(context, item) for each item in items. With workers == 1
+   everything runs serially in this process; otherwise a pool of that many
+   forked processes is used (None meaning one per CPU). Results are yielded
+   in item order if ordered is set, else as soon as each one completes.
+
+   At most workers * chunkSize items are being processed at any one time.
+   """
+   global _shared
+   if workers == 1:
+      for item in items:
+         yield function(context, item)
+      return
+
+   previous = _shared
+   _shared = (function, context)
+   pool = multiprocessing.Pool(workers)
+   try:
+      if ordered:
+         results = pool.imap(_apply, items, chunkSize)
+      else:
+         results = pool.imap_unordered(_apply, items, chunkSize)
+      for result in results:
+         yield result
+      pool.close()
+   finally:
+      pool.terminate()
+      pool.join()
+      _shared = previous
+
+def chunkSizeFor(itemCount, workers):
+   """
+   A chunk size that keeps inter-process overhead low for large numbers of
+   small tasks, while still spreading the items over every worker.
+   """
+   if workers == None:
+      workers = multiprocessing.cpu_count()
+   return max(1, itemCount / (4 * workers))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Low dimensional projections of extracted features, for the embeddings in
+data/cache that data/graph.py plots.
+
+PCA can be fitted exactly (solver 'full'), with a randomised SVD that only
+needs a few passes over the sample ('randomized'), or from a covariance
+matrix accumulated a chunk of examples at a time ('incremental', which also
+accepts memory-mapped samples larger than memory, or partial_fit calls).
+KernelPCA is exact for small samples, and otherwise approximates the kernel
+by its Nystroem approximation on a random subset of landmark examples, so
+that its cost grows linearly with the number of examples.
+
+Embeddings are saved with saveEmbedding as .npz files holding an
+[example, component] 'embedding' array and the corresponding 'classes', e.g.:
+   embedding, classes = projection.projectExperiment(data, 'data/cache/pca-3d.npz')
+   python data/graph.py data/cache/pca-3d.npz
+"""
+
+import signalLearning
+import leastSquares
+import numpy
+import scipy.linalg
+
+class PCA:
+   """
+   Principal component analysis, with the scikits.learn fit/transform
+   interface. solver is 'full', 'randomized', 'incremental', or 'auto',
+   which picks 'randomized' when there are many more examples and features
+   than components, and 'full' otherwise. The randomised solution is
+   approximate where the leading variances are close together; more
+   powerIterations make it more accurate. Fitted components are in
+   self.components_ ([component, feature]), with their variances in
+   self.explained_variance_.
+   """
+
+   def __init__(self, components = 3, solver = 'auto', chunkSize = 1024, oversample = 10,
+                powerIterations = 2, seed = 0):
+      self.components = components
+      self.solver = solver
+      self.chunkSize = chunkSize
+      self.oversample = oversample
+      self.powerIterations = powerIterations
+      self.seed = seed
+      self._count = 0
+
+   def _flat(self, sample):
+      return sample.reshape((len(sample), -1))
+
+   def fit(self, sample, classes = None):
+      sample = self._flat(numpy.asanyarray(sample))
+      solver = self.solver
+      if solver == 'auto':
+         if min(sample.shape) > 4 * (self.components + self.oversample):
+            solver = 'randomized'
+         else:
+            solver = 'full'
+      if solver == 'incremental':
+         self._count = 0
+         for start in range(0, len(sample), self.chunkSize):
+            self.partial_fit(sample[start:start + self.chunkSize])
+         return self
+      elif solver not in ['full', 'randomized']:
+         raise ValueError("solver must be one of 'auto', 'full', 'randomized' or 'incremental'")
+
+      self.mean_ = sample.mean(axis = 0)
+      centred = sample - self.mean_
+      if solver == 'full':
+         left, values, right = scipy.linalg.svd(centred, full_matrices = False)
+      else:
+         left, values, right = self._randomizedSvd(centred)
+      self.components_ = right[:self.components]
+      self.explained_variance_ = numpy.square(values[:self.components]) / len(sample)
+      return self
+
+   def _randomizedSvd(self, centred):
+      """
+      Halko et al.'s randomised SVD: the leading singular vectors of centred
+      from its product with a random matrix, refined by power iterations.
+      """
+      random = numpy.random.RandomState(self.seed)
+      size = min(self.components + self.oversample, min(centred.shape))
+      basis = numpy.dot(centred, random.standard_normal((centred.shape[1], size)))
+      basis, r = scipy.linalg.qr(basis, mode = 'economic')
+      for iteration in range(self.powerIterations):
+         basis, r = scipy.linalg.qr(numpy.dot(centred.T, basis), mode = 'economic')
+         basis, r = scipy.linalg.qr(numpy.dot(centred, basis), mode = 'economic')
+      left, values, right = scipy.linalg.svd(numpy.dot(basis.T, centred), full_matrices = False)
+      return numpy.dot(basis, left), values, right
+
+   def partial_fit(self, sample, classes = None):
+      """
+      Adds a chunk of examples to the covariance accumulated so far, and
+      updates the components from it.
+      """
+      sample = self._flat(numpy.asanyarray(sample, dtype = float))
+      if self._count == 0:
+         self._sum = numpy.zeros(sample.shape[1])
+         self._products = numpy.zeros((sample.shape[1], sample.shape[1]))
+      self._count += len(sample)
+      self._sum += sample.sum(axis = 0)
+      self._products += numpy.dot(sample.T, sample)
+
+      self.mean_ = self._sum / self._count
+      covariance = self._products / self._count - numpy.outer(self.mean_, self.mean_)
+      values, vectors = scipy.linalg.eigh(covariance)
+      order = numpy.argsort(values)[::-1][:self.components]
+      self.components_ = vectors[:, order].T
+      self.explained_variance_ = numpy.maximum(values[order], 0)
+      return self
+
+   def transform(self, sample):
+      sample = self._flat(numpy.asanyarray(sample))
+      embedding = numpy.empty((len(sample), len(self.components_)))
+      for start in range(0, len(sample), self.chunkSize):
+         chunk = sample[start:start + self.chunkSize]
+         embedding[start:start + len(chunk)] = numpy.dot(chunk - self.mean_, self.components_.T)
+      return embedding
+
+   def fit_transform(self, sample, classes = None):
+      return self.fit(sample).transform(sample)
+
+class KernelPCA:
+   """
+   Kernel principal component analysis, with kernel, gamma, degree and coef0
+   as for leastSquares.kernelMatrix. Samples of more than landmarks examples
+   are projected with the Nystroem approximation of the kernel on that many
+   randomly chosen examples, followed by PCA; smaller ones exactly.
+   """
+
+   def __init__(self, components = 3, kernel = 'rbf', gamma = None, degree = 3, coef0 = 1,
+                landmarks = 1000, chunkSize = 1024, seed = 0):
+      self.components = components
+      self.kernel = kernel
+      self.gamma = gamma
+      self.degree = degree
+      self.coef0 = coef0
+      self.landmarks = landmarks
+      self.chunkSize = chunkSize
+      self.seed = seed
+
+   def _kernel(self, left, right):
+      return leastSquares.kernelMatrix(left, right, self.kernel, self.gamma, self.degree,
+                                       self.coef0)
+
+   def _nystroem(self, sample):
+      """
+      Maps sample onto the Nystroem feature space, a chunk at a time.
+      """
+      features = numpy.empty((len(sample), self._map.shape[1]))
+      for start in range(0, len(sample), self.chunkSize):
+         chunk = sample[start:start + self.chunkSize]
+         features[start:start + len(chunk)] = numpy.dot(self._kernel(chunk, self.support_),
+                                                         self._map)
+      return features
+
+   def fit(self, sample, classes = None):
+      sample = numpy.asanyarray(sample)
+      sample = sample.reshape((len(sample), -1))
+      if self.landmarks != None and len(sample) > self.landmarks:
+         random = numpy.random.RandomState(self.seed)
+         chosen = numpy.sort(random.permutation(len(sample))[:self.landmarks])
+         self.support_ = numpy.asarray(sample[chosen], dtype = float)
+         values, vectors = scipy.linalg.eigh(self._kernel(self.support_, self.support_))
+         keep = values > values.max() * 1e-10
+         self._map = vectors[:, keep] / numpy.sqrt(values[keep])
+         self._pca = PCA(self.components, 'full')
+         self._pca.fit(self._nystroem(sample))
+         return self
+
+      self._pca = None
+      self.support_ = numpy.asarray(sample, dtype = float)
+      gram = self._kernel(self.support_, self.support_)
+      self._columnMeans = gram.mean(axis = 0)
+      self._totalMean = self._columnMeans.mean()
+      centred = (gram - self._columnMeans[:, numpy.newaxis] - self._columnMeans
+                 + self._totalMean)
+      values, vectors = scipy.linalg.eigh(centred)
+      order = numpy.argsort(values)[::-1][:self.components]
+      values = numpy.maximum(values[order], 1e-12)
+      self.explained_variance_ = values / len(sample)
+      self.dual_coef_ = vectors[:, order] / numpy.sqrt(values)
+      return self
+
+   def transform(self, sample):
+      sample = numpy.asanyarray(sample)
+      sample = sample.reshape((len(sample), -1))
+      if self._pca != None:
+         return self._pca.transform(self._nystroem(sample))
+      embedding = numpy.empty((len(sample), self.dual_coef_.shape[1]))
+      for start in range(0, len(sample), self.chunkSize):
+         gram = self._kernel(sample[start:start + self.chunkSize], self.support_)
+         centred = (gram - gram.mean(axis = 1)[:, numpy.newaxis] - self._columnMeans
+                    + self._totalMean)
+         embedding[start:start + len(gram)] = numpy.dot(centred, self.dual_coef_)
+      return embedding
+
+   def fit_transform(self, sample, classes = None):
+      return self.fit(sample).transform(sample)
+
+def saveEmbedding(filename, embedding, classes, **metadata):
+   """
+   Saves an [example, component] embedding and its class labels to the .npz
+   file filename, along with any metadata (strings or numbers describing
+   how it was produced).
+   """
+   arrays = dict([('meta_' + name, numpy.asarray(value)) for name, value in metadata.items()])
+   numpy.savez(filename, embedding = numpy.asarray(embedding), classes = numpy.asarray(classes),
+               **arrays)
+
+def loadEmbedding(filename):
+   """
+   Returns the embedding, classes and metadata dict saved by saveEmbedding.
+   """
+   archive = numpy.load(filename)
+   metadata = dict([(name[len('meta_'):], archive[name].tolist()) for name in archive.files
+                    if name.startswith('meta_')])
+   return archive['embedding'], archive['classes'], metadata
+
+def projectExperiment(data, filename = None, method = 'pca', components = 3, numBins = 32,
+                      subjectIndex = None, featureCache = None, **options):
+   """
+   Projects the spectral features (getSpectralDecompArray with numBins bins)
+   of every epoch of the ExperimentData data, or of one subject, onto
+   components dimensions by PCA (method = 'pca') or kernel PCA
+   (method = 'kernelpca'). Any further options are passed on to PCA or
+   KernelPCA. The embedding is saved to filename with saveEmbedding, if given.
+
+   Returns:
+   embedding - an [epoch, component] array
+   classes   - the corresponding class labels
+   """
+   projections = {'pca': PCA, 'kernelpca': KernelPCA}
+   if method not in projections:
+      raise ValueError("method must be one of 'pca' or 'kernelpca'")
+   sigLearnInstance = signalLearning.SignalLearn(featureCache)
+   sample, classes = sigLearnInstance.getSpectralDecompArray(data, numBins, subjectIndex)
+   embedding = projections[method](components, **options).fit_transform(sample)
+   if filename != None:
+      saveEmbedding(filename, embedding, classes, method = method, numBins = numBins,
+                    options = repr(sorted(options.items())))
+   return embedding, classes
@@ -8,19 +8,44 @@ Then, apply learning algorithms in a way that gives informative output!
 
 from data.convertMat import ExperimentData, TaskRecording
 import spectrum
+import parallel
+import metrics
+import instrument
+import features
 import scikits.learn.cross_val as cross_val
 import numpy
-import time
+import copy
 
 class SignalLearn:
 
+   def __init__(self, featureCache = None, instrumentation = None):
+      """
+      featureCache is an optional featureCache.FeatureCache, through which
+      per-recording features are reused between calls.
+      instrumentation is an optional instrument.Recorder (or similar), which
+      is passed the timings of feature extraction, copies and each fold's
+      fit/predict/scoring, and the progress of cross-validation.
+      """
+      self.featureCache = featureCache
+      if instrumentation == None:
+         instrumentation = instrument.Instrument()
+      self.instrumentation = instrumentation
+
+   def _taskFeatures(self, task, featureType, compute, **params):
+      """
+      Returns compute(task), from the feature cache if there is one.
+      """
+      with self.instrumentation.stage('features', feature = featureType):
+         if self.featureCache == None:
+            return compute(task)
+         return self.featureCache.fetch(task, featureType, compute, **params)
+
    def rootMeanSquare(self, arrayLike):
       """
-      Returns the root mean square of the elements in arrayLike.
+      Returns the root mean square of the elements in arrayLike. As with the
+      rest of the RMS features, this is the root of their sum of squares.
       """
-      array = numpy.asanyarray(arrayLike)
-      rms = numpy.sqrt(numpy.sum(numpy.square(array)))
-      return rms
+      return spectrum.RMS(arrayLike)
 
    def getRmsList(self, data, subjectIndex = None):
       """
@@ -36,19 +61,37 @@ class SignalLearn:
       assert(data.__class__ == ExperimentData)
       sample = []
       classes = []
-      for subject, index in zip(data.matrix, range(len(data.matrix))):
-         for task in subject:
-            if subjectIndex == None or index == subjectIndex:
-               if task.nEpochs == 1:
-                  rmsList = [self.rootMeanSquare(channel) for channel in task.data]
-                  sample.append(rmsList)
-                  classes.append(task.condition)
-               else:
-                  for epoch in range(task.nEpochs):
-                     rmsList = [self.rootMeanSquare(channel) for channel in task.data[:, :, epoch]]
-                     sample.append(rmsList)
-                     classes.append(task.condition)
+      for task in self._selectTasks(data, subjectIndex):
+         rms = self._taskFeatures(task, 'rms', self._taskRms)
+         sample.extend(rms.tolist())
+         classes.extend([task.condition] * len(rms))
       return sample, classes
+
+   def _taskRms(self, task):
+      """
+      Returns an [epoch, channel] array of RMS values for a TaskRecording,
+      all computed in one vectorised reduction.
+      """
+      return spectrum.RMS(self._epochView(task), axis = -1)
+
+   def getFeatureMatrix(self, data, subjectIndex = None, featureList = features.FEATURES,
+                        bands = spectrum.EEG_BANDS, chunkSize = 64):
+      """
+      Given an ExperimentData object data, computes the features of
+      featureList (see the features module: RMS, variance, line length, Hjorth
+      mobility and complexity, and power in each of bands) for every channel
+      of every epoch, all in a single chunked pass over each recording's data.
+      features.featureNames gives the name of each column.
+
+      Returns:
+      sample  - an [epoch, channel * feature] array of features
+      classes - a corresponding array of class labels
+      """
+      assert(data.__class__ == ExperimentData)
+      return self._featureArray(data, subjectIndex, 'features',
+            lambda task: features.epochFeatures(self._epochView(task), task.sampleRate,
+                                                featureList, bands, chunkSize),
+            featureList = repr(list(featureList)), bands = repr(bands))
    
    def spectrumFilter(self, spec, freqs, lowCutoff, highCutoff):
       """
@@ -58,13 +101,11 @@ class SignalLearn:
       if len(spec) != len(freqs):
          raise ValueError("spec and freqs must be of equal length")
 
-      filterMatrix = numpy.empty_like(freqs, dtype = 'bool')
-      if lowCutoff != None or highCutoff != None:
-         for i, s, f in zip(range(len(filterMatrix)), spec, freqs):
-            if (lowCutoff != None and f < lowCutoff) or (highCutoff != None and f > highCutoff):
-               filterMatrix[i] = False
-            else:
-               filterMatrix[i] = True
+      filterMatrix = numpy.ones(len(freqs), dtype = 'bool')
+      if lowCutoff != None:
+         filterMatrix &= freqs >= lowCutoff
+      if highCutoff != None:
+         filterMatrix &= freqs <= highCutoff
       return spec[filterMatrix], freqs[filterMatrix]
 
    def getSpectralDecomp(self, data, numBins, subjectIndex = None, lowCutoff = None, highCutoff = None):
@@ -113,6 +154,152 @@ class SignalLearn:
                      classes.append(task.condition)
       return sample, classes
 
+   def _selectTasks(self, data, subjectIndex = None):
+      """
+      Yields the TaskRecordings of data in matrix order, restricted to the
+      subject at subjectIndex if one is given.
+      """
+      for index, subject in enumerate(data.matrix):
+         if subjectIndex == None or index == subjectIndex:
+            for task in subject:
+               yield task
+
+   def _epochView(self, task):
+      """
+      Returns a view of task.data with [epoch, channel, sample] axes, so that
+      single and multiple epoch recordings can be processed uniformly.
+      """
+      if task.data.ndim == 2:
+         return task.data[numpy.newaxis, :, :]
+      else:
+         return task.data.transpose((2, 0, 1))
+
+   def _taskSpectra(self, task, numBins, lowCutoff = None, highCutoff = None, trim = True):
+      """
+      Returns the [epoch, channel, frequency bucket] spectra of a TaskRecording.
+      """
+      spectra, freqs = spectrum.solveSpectra(self._epochView(task), task.sampleRate)
+      if lowCutoff != None or highCutoff != None:
+         # freqs is sorted, so the filter reduces to a slice
+         start = numpy.searchsorted(freqs, lowCutoff, side = 'left') if lowCutoff != None else 0
+         stop = numpy.searchsorted(freqs, highCutoff, side = 'right') if highCutoff != None else None
+         spectra = spectra[..., start:stop]
+      return spectrum.binSpectra(spectra, numBins, method = 'sum', trim = trim)
+
+   def getFullSpectrumArray(self, data, subjectIndex = None):
+      """
+      Returns the unbinned spectra that getSpectralDecompArray's features are
+      binned from, so that features for several numBins values can be derived
+      from a single FFT per epoch with spectrum.binSpectra.
+
+      Returns:
+      sample  - an [epoch, channel, frequency] array of spectral magnitudes
+      classes - a corresponding array of class labels
+      """
+      assert(data.__class__ == ExperimentData)
+      return self._featureArray(data, subjectIndex, 'spectrum',
+            lambda task: spectrum.solveSpectra(self._epochView(task), task.sampleRate)[0])
+
+   def getSpectralDecompArray(self, data, numBins, subjectIndex = None,
+                              lowCutoff = None, highCutoff = None, trim = True):
+      """
+      Batched equivalent of getSpectralDecomp. Rather than transforming each
+      channel of each epoch separately, the spectra of every channel and epoch
+      of a TaskRecording are calculated with a single FFT call and binned with
+      a single reshape and reduction, directly into a preallocated array.
+
+      Unlike getSpectralDecomp, frequencies outside lowCutoff and highCutoff
+      are filtered out (as by spectrumFilter) before binning, and with trim
+      set to False the bins are allowed to differ in size by one element
+      rather than the highest frequencies being discarded.
+
+      Returns:
+      sample  - an [epoch, channel, frequency buckets] array of power densities
+      classes - a corresponding array of class labels
+      """
+      assert(data.__class__ == ExperimentData)
+      assert(numBins != 0)
+      return self._featureArray(data, subjectIndex, 'spectral',
+            lambda task: self._taskSpectra(task, numBins, lowCutoff, highCutoff, trim),
+            numBins = numBins, lowCutoff = lowCutoff, highCutoff = highCutoff, trim = trim)
+
+   def getBandPowerArray(self, data, bands = spectrum.EEG_BANDS, subjectIndex = None,
+                         method = 'welch', **options):
+      """
+      Given an ExperimentData object data, produces the power in each of the
+      given frequency bands (see spectrum.bandIndices) for each channel of
+      each epoch, from a Welch or multitaper (method) power spectral density
+      estimate. Band index ranges are computed once per frequency grid and
+      every band of a recording is summed in a single vectorised pass.
+
+      Returns:
+      sample  - an [epoch, channel, band] array of band powers
+      classes - a corresponding array of class labels
+      """
+      assert(data.__class__ == ExperimentData)
+      estimators = {'welch': spectrum.welch, 'multitaper': spectrum.multitaper}
+      if method not in estimators:
+         raise ValueError("method must be one of 'welch' or 'multitaper'")
+
+      def compute(task):
+         psd, freqs = estimators[method](self._epochView(task), task.sampleRate, **options)
+         starts, stops = spectrum.bandIndices(freqs, bands)
+         # integrate the density over each band
+         return spectrum.bandPower(psd, starts, stops) * (freqs[1] - freqs[0])
+      return self._featureArray(data, subjectIndex, 'bandPower:' + method, compute,
+            bands = repr(bands), **options)
+
+   def _featureArray(self, data, subjectIndex, featureType, compute, **params):
+      """
+      Stacks the [epoch, ...] feature arrays produced by compute(task) for
+      each selected TaskRecording (through the feature cache, if any) into a
+      single preallocated array.
+
+      Returns:
+      sample  - an [epoch, ...] array of features
+      classes - a corresponding array of class labels
+      """
+      tasks = list(self._selectTasks(data, subjectIndex))
+      epochTotal = sum([task.nEpochs for task in tasks])
+
+      sample = None
+      classes = numpy.empty(epochTotal, dtype = int)
+      offset = 0
+      for task in tasks:
+         features = self._taskFeatures(task, featureType, compute, **params)
+         if sample is None:
+            sample = numpy.empty((epochTotal,) + features.shape[1:], dtype = features.dtype)
+         sample[offset:offset + task.nEpochs] = features
+         classes[offset:offset + task.nEpochs] = task.condition
+         offset += task.nEpochs
+      return sample, classes
+
+   def getPowerSpectrumArray(self, data, numBins, subjectIndex = None, method = 'welch',
+                             lowCutoff = None, highCutoff = None, **options):
+      """
+      Like getSpectralDecompArray, but with features taken from a power
+      spectral density estimate, by Welch's method (method = 'welch') or the
+      multitaper method (method = 'multitaper'), restricted to frequencies
+      between lowCutoff and highCutoff before binning. Any further options
+      are passed on to spectrum.welch or spectrum.multitaper.
+
+      Returns:
+      sample  - an [epoch, channel, frequency buckets] array of power densities
+      classes - a corresponding array of class labels
+      """
+      assert(data.__class__ == ExperimentData)
+      assert(numBins != 0)
+      estimators = {'welch': spectrum.welch, 'multitaper': spectrum.multitaper}
+      if method not in estimators:
+         raise ValueError("method must be one of 'welch' or 'multitaper'")
+
+      def compute(task):
+         psd, freqs = estimators[method](self._epochView(task), task.sampleRate,
+               lowCutoff = lowCutoff, highCutoff = highCutoff, **options)
+         return spectrum.binSpectra(psd, numBins, method = 'sum')
+      return self._featureArray(data, subjectIndex, method, compute, numBins = numBins,
+            lowCutoff = lowCutoff, highCutoff = highCutoff, **options)
+
    def crossValAccuracy(self, crossValResults, trueClasses):
       """
       Returns the accuracy of cross-validation output classifications,
@@ -120,37 +307,22 @@ class SignalLearn:
       """
       ndResults = numpy.asanyarray(crossValResults)
       ndClasses = numpy.asanyarray(trueClasses)
-
-      correct = 0
-      for i in range(len(ndResults)):
-         if (ndResults[i] == ndClasses[i]):
-            correct += 1
-
-      if correct > 0:
-         return float(correct) / len(ndResults)
-      else:
+      if len(ndResults) == 0:
          return 0
+      return float(numpy.count_nonzero(ndResults == ndClasses)) / len(ndResults)
 
-   def _perClassAccuracy(self, crossValResults, trueClasses):
+   def _perClassAccuracy(self, crossValResults, trueClasses, labels = None):
       """
       Given cross-validation classification output and the true classes of each
-      element, returns a [subjects x classes] matrix with the accuracy of
-      prediction per class per subject.
+      element, returns the accuracy of prediction per class, for each of
+      labels (by default the classes present in trueClasses). Classes with no
+      elements are given an accuracy of NaN.
       """
-      ndResults = numpy.asanyarray(crossValResults)
       ndClasses = numpy.asanyarray(trueClasses)
-
-      classCorrect = numpy.zeros_like(numpy.unique(ndClasses))
-      classTotal = numpy.zeros_like(classCorrect)
-      classIndex = dict(zip(numpy.unique(ndClasses).tolist(), range(len(classTotal))))
-      
-      for result, cls in zip(ndResults, ndClasses):
-         if result == cls:
-            classCorrect[classIndex[cls]] += 1
-         classTotal[classIndex[cls]] += 1
-
-      accuracies = numpy.true_divide(classCorrect, classTotal)
-      return accuracies
+      if labels is None:
+         labels = numpy.unique(ndClasses)
+      confusion = metrics.confusionMatrix(crossValResults, ndClasses, labels)
+      return metrics.classAccuracy(confusion)
    
    def _flatten2D(self, arrayLike):
       if (arrayLike.ndim <= 2):
@@ -158,39 +330,196 @@ class SignalLearn:
       else:
          return arrayLike.reshape((arrayLike.shape[0], arrayLike[0].size))
 
-   def _crossVal(self, sample, classes, learner, classifier, crossValMatrix, progressGranularity):
+   def _runFold(self, context, fold):
       """
-      Runs the actual cross-validation process, as well as printing progress to
-      stdout.
+      Trains and tests a single cross-validation fold. Returns the test index,
+      the classifications of the test set and their per-class accuracy.
       """
-      print "Starting cross-validation..."
-      progress = 0
-      resultsVector = numpy.zeros(len(sample))
-      classAccuracies = numpy.zeros((len(crossValMatrix), len(numpy.unique(classes))))
-      for trainIndex, testIndex in crossValMatrix:
-         # Assign train/test sets to arrays
-         trainSample = self._flatten2D(sample[trainIndex])
-         trainClasses = classes[trainIndex]
-         testSample = self._flatten2D(sample[testIndex])
-         testClasses = classes[testIndex]
+      flatSample, classes, labels, learner, classifier, trainBuffer, instrumentation = context
+      trainIndex, testIndex = fold
+      # Assign train/test sets to arrays, copying as little as possible
+      with instrumentation.stage('copy'):
+         trainSample, trainClasses, copiedRows = trainBuffer.rows(self._asIndices(trainIndex))
+         testSample, testClasses, testCopied = self._foldRows(flatSample, classes,
+                                                              self._asIndices(testIndex))
+      instrumentation.count('copiedBytes', (copiedRows + testCopied) * flatSample[0].nbytes)
 
-         # Learn the training set
+      # Learn the training set
+      with instrumentation.stage('fit'):
          learner(trainSample, trainClasses)
-         # Attempt classification and store results
+      # Attempt classification and store results
+      with instrumentation.stage('predict'):
          results = classifier(testSample)
+      with instrumentation.stage('score'):
+         accuracies = self._perClassAccuracy(results, testClasses, labels)
+      return testIndex, results, accuracies, instrumentation.drain()
+
+   def _crossVal(self, sample, classes, learner, classifier, crossValMatrix, progressGranularity,
+                 workers = 1, incremental = False):
+      """
+      Runs the actual cross-validation process, as well as reporting progress
+      through the instrumentation (by default, to stdout). Folds are spread
+      over workers processes (see parallel.forkMap), each of which trains its
+      own copy of the learner on the shared sample. Results are merged in fold
+      order, so for learners whose fit is deterministic they are identical to
+      a serial run.
+
+      The sample is flattened to a contiguous 2D array once. Contiguous test
+      (and training) sets are passed to the learner as views of it, and other
+      training sets are assembled in a buffer reused between folds (see
+      _TrainingBuffer), so no fold allocates a copy of the whole sample.
+      Learners should therefore not keep references to their training data
+      beyond the fold.
+
+      If incremental is set, the folds are instead run serially by
+      _incrementalCrossVal, and workers must be 1.
+      """
+      if incremental:
+         if workers != 1:
+            raise ValueError("Incremental cross-validation runs serially; workers must be 1")
+         return self._incrementalCrossVal(sample, classes, learner, classifier,
+               crossValMatrix, progressGranularity)
+      self.instrumentation.message("Starting cross-validation...")
+      progress = 0
+      resultsVector = numpy.zeros(len(sample))
+      labels = numpy.unique(classes)
+      classAccuracies = numpy.zeros((len(crossValMatrix), len(labels)))
+      flatSample = numpy.ascontiguousarray(self._flatten2D(sample))
+      # serial folds report straight to the instrumentation, so that they can
+      # be profiled and memory-measured; forked ones buffer their events
+      if workers == 1:
+         foldInstrumentation = self.instrumentation
+      else:
+         foldInstrumentation = self.instrumentation.buffer()
+      context = (flatSample, classes, labels, learner, classifier,
+                 _TrainingBuffer(flatSample, classes), foldInstrumentation)
+      chunkSize = parallel.chunkSizeFor(len(crossValMatrix), workers)
+      for testIndex, results, accuracies, events in parallel.forkMap(self._runFold, context,
+            crossValMatrix, workers, chunkSize = chunkSize):
          resultsVector[testIndex] = results
-         classAccuracies[progress] = self._perClassAccuracy(results, testClasses)
+         classAccuracies[progress] = accuracies
+         if events != None:
+            self.instrumentation.replay(events)
 
          progress += 1
          if progress % progressGranularity == 0:
-            print "{0}: {1}/{2} done".format(time.strftime("%H:%M:%S"), progress, len(crossValMatrix)) 
+            self.instrumentation.progress(progress, len(crossValMatrix))
       return resultsVector, classAccuracies
    
+   def _foldRows(self, flatSample, classes, index):
+      """
+      Returns the rows of flatSample and classes at the indices index, as
+      views if they are consecutive, along with the number of rows copied.
+      """
+      rows = _consecutive(index)
+      if rows != None:
+         return flatSample[rows], classes[rows], 0
+      return flatSample[index], classes[index], len(index)
+
+   def _asIndices(self, index):
+      """
+      Converts a boolean mask or index array to an index array.
+      """
+      index = numpy.asanyarray(index)
+      if index.dtype == bool:
+         return numpy.flatnonzero(index)
+      return index
+
+   def _feed(self, update, sample, classes, indices, chunkSize):
+      """
+      Passes sample[indices] and classes[indices] to update in chunks of at
+      most chunkSize examples.
+      """
+      for start in range(0, len(indices), chunkSize):
+         chunk = indices[start:start + chunkSize]
+         with self.instrumentation.stage('fit'):
+            update(sample[chunk], classes[chunk])
+
+   def _incrementalCrossVal(self, sample, classes, learner, classifier, crossValMatrix,
+                            progressGranularity, chunkSize = 1000):
+      """
+      Cross-validation for learners that can be trained incrementally, which
+      reuses the model between folds instead of refitting it from scratch.
+
+      learner must be the partial_fit(sample, classes) style method of a
+      learner object, and classifier its predict method. Training
+      data is streamed to it in chunks of chunkSize examples. If the object
+      also has a downdate(sample, classes) method that exactly removes
+      examples, it is trained once on the whole sample, and each fold just
+      downdates the test examples, classifies them and adds them back.
+      Otherwise the folds are processed as a binary tree (TreeCV): a model
+      trained on every fold outside a range of folds is copied and extended
+      with one half of the range to evaluate the other half, so each example
+      is added O(log folds) times rather than once per fold.
+
+      Every training set must be the complement of its test set, as with
+      KFold, StratifiedKFold and LeaveOneOut. The learner passed in is not
+      modified; a copy of it is reset by fitting it to no examples, so that
+      nothing it was already trained on leaks into the folds, and trained.
+      """
+      self.instrumentation.message("Starting incremental cross-validation...")
+      flatSample = self._flatten2D(sample)
+      model = copy.deepcopy(learner.__self__)
+      model.fit(flatSample[:0], classes[:0])
+      update = learner.__name__
+      predict = classifier.__name__
+
+      folds = []
+      for trainIndex, testIndex in crossValMatrix:
+         testIndex = self._asIndices(testIndex)
+         if len(self._asIndices(trainIndex)) + len(testIndex) != len(sample):
+            raise ValueError("Incremental cross-validation needs complementary train/test sets")
+         folds.append(testIndex)
+
+      resultsVector = numpy.zeros(len(sample))
+      labels = numpy.unique(classes)
+      classAccuracies = numpy.zeros((len(folds), len(labels)))
+      progress = [0]
+
+      def evaluate(model, fold):
+         testIndex = folds[fold]
+         with self.instrumentation.stage('predict'):
+            results = getattr(model, predict)(flatSample[testIndex])
+         resultsVector[testIndex] = results
+         with self.instrumentation.stage('score'):
+            classAccuracies[fold] = self._perClassAccuracy(results, classes[testIndex], labels)
+         progress[0] += 1
+         if progress[0] % progressGranularity == 0:
+            self.instrumentation.progress(progress[0], len(folds))
+
+      def foldRange(low, high):
+         return numpy.concatenate(folds[low:high])
+
+      def treeCrossVal(model, low, high):
+         # model has been trained on every fold outside [low, high)
+         if high - low == 1:
+            evaluate(model, low)
+            return
+         middle = (low + high) / 2
+         with self.instrumentation.stage('copyModel'):
+            left = copy.deepcopy(model)
+         self._feed(getattr(left, update), flatSample, classes, foldRange(middle, high), chunkSize)
+         treeCrossVal(left, low, middle)
+         del left
+         self._feed(getattr(model, update), flatSample, classes, foldRange(low, middle), chunkSize)
+         treeCrossVal(model, middle, high)
+
+      if hasattr(model, 'downdate'):
+         self._feed(getattr(model, update), flatSample, classes, foldRange(0, len(folds)), chunkSize)
+         for fold, testIndex in enumerate(folds):
+            with self.instrumentation.stage('downdate'):
+               model.downdate(flatSample[testIndex], classes[testIndex])
+            evaluate(model, fold)
+            getattr(model, update)(flatSample[testIndex], classes[testIndex])
+      else:
+         treeCrossVal(model, 0, len(folds))
+      return resultsVector, classAccuracies
+
    def _printAccuracy(self, meanAccuracy, classAccuracy):
-      print "Cross-validation accuracy:", meanAccuracy
-      print "Per-class cross-validation accuracy:", classAccuracy
+      self.instrumentation.message("Cross-validation accuracy: {0}".format(meanAccuracy))
+      self.instrumentation.message("Per-class cross-validation accuracy: {0}".format(classAccuracy))
 
-   def kFoldVal(self, sample, classes, learner, classifier, k = 10):
+   def kFoldVal(self, sample, classes, learner, classifier, k = 10, workers = 1, incremental = False):
       """
       Peforms k-fold validation on the given learner/classifier pair, given
       an [examples, features] sample array and the associated [examples]
@@ -199,6 +528,12 @@ class SignalLearn:
       Learner and classifier are assumed to be functions that can be called as:
       learner(sample, classes)
       result = classifier(sample) 
+
+      Folds are run in parallel over workers processes if workers is not 1
+      (None uses every CPU). If incremental is set, learner must instead be
+      the partial_fit method of an incrementally trainable learner (see
+      _incrementalCrossVal), and the model is reused between folds serially,
+      so workers must then be 1.
       """
       assert(len(sample) == len(classes))
       sampleSize = len(sample)
@@ -206,14 +541,14 @@ class SignalLearn:
       ndClasses = numpy.asanyarray(classes)
 
       crossValMatrix = cross_val.KFold(sampleSize, k)
-      resultsVector, classResults = self._crossVal(ndSample, ndClasses, learner, classifier, crossValMatrix, 1)
+      resultsVector, classResults = self._crossVal(ndSample, ndClasses, learner, classifier, crossValMatrix, 1, workers, incremental)
       accuracy = self.crossValAccuracy(resultsVector, ndClasses)
-      classAccuracy = [numpy.rint(cls).sum() / cls.size for cls in numpy.transpose(classResults)]
+      classAccuracy = metrics.foldSummary(classResults).tolist()
       self._printAccuracy(accuracy, classAccuracy)
 
       return resultsVector, accuracy, classAccuracy
 
-   def stratifiedKFoldVal(self, sample, classes, learner, classifier, k = 5):
+   def stratifiedKFoldVal(self, sample, classes, learner, classifier, k = 5, workers = 1, incremental = False):
       """
       Peforms stratified k-fold validation on the given learner/classifier pair, 
       given an [examples, features] sample array and the associated [examples]
@@ -222,6 +557,12 @@ class SignalLearn:
       Learner and classifier are assumed to be functions that can be called as:
       learner(sample, classes)
       result = classifier(sample) 
+
+      Folds are run in parallel over workers processes if workers is not 1
+      (None uses every CPU). If incremental is set, learner must instead be
+      the partial_fit method of an incrementally trainable learner (see
+      _incrementalCrossVal), and the model is reused between folds serially,
+      so workers must then be 1.
       """
       assert(len(sample) == len(classes))
       sampleSize = len(sample)
@@ -229,15 +570,30 @@ class SignalLearn:
       ndClasses = numpy.asanyarray(classes)
 
       crossValMatrix = cross_val.StratifiedKFold(ndClasses, k)
-      resultsVector, classResults = self._crossVal(ndSample, ndClasses, learner, classifier, crossValMatrix, 1)
+      resultsVector, classResults = self._crossVal(ndSample, ndClasses, learner, classifier, crossValMatrix, 1, workers, incremental)
       accuracy = self.crossValAccuracy(resultsVector, ndClasses)
-      classAccuracy = [numpy.rint(cls).sum() / cls.size for cls in numpy.transpose(classResults)]
+      classAccuracy = metrics.foldSummary(classResults).tolist()
       self._printAccuracy(accuracy, classAccuracy)
 
       return resultsVector, accuracy, classAccuracy
       
 
-   def leaveOneOut(self, sample, classes, learner, classifier):
+   def _looClassAccuracies(self, resultsVector, classes):
+      """
+      Returns the [folds x classes] per-class accuracy matrix of _crossVal
+      for leave-one-out classifications that have already been made. Each
+      fold holds a single example, so each row is NaN but for the column of
+      that example's class, which is 1 if it was classified correctly.
+      """
+      labels = numpy.unique(classes)
+      classAccuracies = numpy.empty((len(classes), len(labels)))
+      classAccuracies.fill(numpy.nan)
+      classAccuracies[numpy.arange(len(classes)), numpy.searchsorted(labels, classes)] = \
+            resultsVector == classes
+      return classAccuracies
+
+   def leaveOneOut(self, sample, classes, learner, classifier, workers = 1, incremental = False,
+                   fast = False):
       """
       Performs leave-one-out cross-validation on the given learner/classifier
       pair, given a [examples, features] sample array and the associated
@@ -246,6 +602,18 @@ class SignalLearn:
       Learner and classifier are assumed to be functions that can be called as:
       learner(sample, classes)
       result = classifier(sample) 
+
+      Folds are run in parallel over workers processes if workers is not 1
+      (None uses every CPU). If incremental is set, learner must instead be
+      the partial_fit method of an incrementally trainable learner (see
+      _incrementalCrossVal), and the model is reused between folds serially,
+      so workers must then be 1.
+
+      If fast is set and learner belongs to an object with a
+      looPredict(sample, classes) method (such as the least-squares
+      classifiers of the leastSquares module), every held-out classification
+      is obtained from that single fit instead. Other learners fall back to
+      the generic loop.
       """
       PROGRESS_FACTOR = 200
 
@@ -259,9 +627,75 @@ class SignalLearn:
          progressGranularity = sampleSize / PROGRESS_FACTOR
       else:
          progressGranularity = 1
-      resultsVector, classResults = self._crossVal(ndSample, ndClasses, learner, classifier, crossValMatrix, progressGranularity)
+      owner = getattr(learner, '__self__', None)
+      if fast and hasattr(owner, 'looPredict'):
+         self.instrumentation.message("Starting fast leave-one-out...")
+         resultsVector = numpy.zeros(sampleSize)
+         with self.instrumentation.stage('looPredict'):
+            resultsVector[:] = owner.looPredict(self._flatten2D(ndSample), ndClasses)
+         with self.instrumentation.stage('score'):
+            classResults = self._looClassAccuracies(resultsVector, ndClasses)
+      else:
+         resultsVector, classResults = self._crossVal(ndSample, ndClasses, learner, classifier, crossValMatrix, progressGranularity, workers, incremental)
       accuracy = self.crossValAccuracy(resultsVector, ndClasses)
-      classAccuracy = [numpy.rint(cls).sum() / cls.size for cls in numpy.transpose(classResults)]
+      classAccuracy = metrics.foldSummary(classResults).tolist()
       self._printAccuracy(accuracy, classAccuracy)
 
       return resultsVector, accuracy, classAccuracy
+
+
+def _consecutive(index):
+   """
+   Returns the slice equivalent to an index array of consecutive increasing
+   indices, or None if it is not one.
+   """
+   if len(index) == 0 or index[-1] - index[0] != len(index) - 1:
+      return None
+   if len(index) > 1 and not (numpy.diff(index) == 1).all():
+      return None
+   return slice(index[0], index[-1] + 1)
+
+class _TrainingBuffer:
+   """
+   Assembles cross-validation training sets from the rows of a 2D sample in
+   a single preallocated buffer. Successive training sets overlap almost
+   entirely (leave-one-out training sets differ in one row, k-fold ones in
+   two folds' worth), so only the buffer positions whose row differs from
+   the previous fold are copied. Each worker process, having forked its own
+   copy, keeps a buffer of its own.
+   """
+
+   BLOCK_ROWS = 64
+
+   def __init__(self, flatSample, classes):
+      self.flatSample = flatSample
+      self.classes = classes
+      self.sample = None
+      self.sampleClasses = None
+      self.index = None
+
+   def rows(self, index):
+      """
+      Returns the training sample and classes at the indices index, and the
+      number of rows that had to be copied to produce them.
+      """
+      rows = _consecutive(index)
+      if rows != None:
+         return self.flatSample[rows], self.classes[rows], 0
+      if self.sample is None:
+         self.sample = numpy.empty(self.flatSample.shape, dtype = self.flatSample.dtype)
+         self.sampleClasses = numpy.empty(self.classes.shape, dtype = self.classes.dtype)
+      if self.index is not None and len(self.index) == len(index):
+         changed = numpy.flatnonzero(self.index != index)
+         # copied in blocks, to bound the size of the temporary copies
+         for start in range(0, len(changed), self.BLOCK_ROWS):
+            block = changed[start:start + self.BLOCK_ROWS]
+            self.sample[block] = self.flatSample[index[block]]
+            self.sampleClasses[block] = self.classes[index[block]]
+         copied = len(changed)
+      else:
+         numpy.take(self.flatSample, index, axis = 0, out = self.sample[:len(index)])
+         numpy.take(self.classes, index, out = self.sampleClasses[:len(index)])
+         copied = len(index)
+      self.index = index
+      return self.sample[:len(index)], self.sampleClasses[:len(index)], copied
@@ -2,6 +2,7 @@
 
 import numpy as np
 import scipy.fftpack as fftp
+import scipy.signal as signal
 
 """
 A number of utility functions for extracting spectrums from
@@ -42,10 +43,266 @@ def bin(signal, numBins, method='sum'):
       raise ValueError("Method must be one of 'sum' or 'mean'")
 
 """
-Calculates Root mean squared of a given signal
+Batched equivalent of solveSpectrum: calculates the spectral decomposition of
+every 1 dimensional series along the given axis of signals in a single call.
+Returns:
+    spectra, with the same shape as signals
+    bin labels
+"""
+def solveSpectra(signals, sampleRate, axis=-1):
+
+   signals = np.asanyarray(signals)
+   return (np.abs(fftp.rfft(signals, axis=axis)),
+           fftp.rfftfreq(signals.shape[axis], 1./sampleRate))
+
+
+"""
+Batched equivalent of bin: reduces the last axis of spectra into numBins
+evenly sized bins with a single reshape and reduction. As in
+SignalLearn.getSpectralDecomp, any trailing (highest frequency) elements that
+do not fit evenly into the bins are trimmed first, unless trim is False, in
+which case the bins differ in size by at most one element (see binIndices)
+and nothing is discarded.
+"""
+def binSpectra(spectra, numBins, method='sum', trim=True):
+
+   if numBins <= 0 or numBins > spectra.shape[-1]:
+      raise ValueError("numBins must be between 1 and the spectrum length")
+
+   if not trim:
+      starts, stops = binIndices(spectra.shape[-1], numBins)
+      return bandPower(spectra, starts, stops, method)
+
+   binWidth = spectra.shape[-1] / numBins
+   trimmed = spectra[..., :numBins * binWidth]
+   binned = trimmed.reshape(spectra.shape[:-1] + (numBins, binWidth))
+   if method == 'sum':
+      return binned.sum(axis=-1)
+   elif method == 'mean':
+      return binned.mean(axis=-1)
+   else:
+      raise ValueError("Method must be one of 'sum' or 'mean'")
+
+# Windows, tapers and frequency grids depend only on the segment length (and
+# sample rate), so they are computed once and reused across calls.
+_windows = {}
+_tapers = {}
+_frequencies = {}
+_bands = {}
+_bandIndices = {}
+_binIndices = {}
+
+"""
+Returns the frequency of each element of a one-sided (numpy.fft.rfft)
+spectrum of a length sample signal, cached per (length, sampleRate).
+"""
+def frequencies(length, sampleRate):
+
+   key = (length, float(sampleRate))
+   if key not in _frequencies:
+      _frequencies[key] = np.arange(length / 2 + 1) * (float(sampleRate) / length)
+   return _frequencies[key]
+
+"""
+Returns the slice of a one-sided spectrum of a length sample signal that
+keeps only frequencies f with lowCutoff <= f <= highCutoff, as
+SignalLearn.spectrumFilter does. Either cutoff may be None.
+"""
+def bandSlice(length, sampleRate, lowCutoff=None, highCutoff=None):
+
+   key = (length, float(sampleRate), lowCutoff, highCutoff)
+   if key not in _bands:
+      freqs = frequencies(length, sampleRate)
+      start, stop = 0, freqs.size
+      if lowCutoff != None:
+         start = np.searchsorted(freqs, lowCutoff, side='left')
+      if highCutoff != None:
+         stop = np.searchsorted(freqs, highCutoff, side='right')
+      _bands[key] = slice(start, stop)
+   return _bands[key]
+
+"""
+Returns the named (scipy.signal.get_window) window of the given length, cached.
+"""
+def window(name, length):
+
+   key = (name, length)
+   if key not in _windows:
+      _windows[key] = signal.get_window(name, length)
+   return _windows[key]
+
+"""
+Returns a [numTapers, length] array of discrete prolate spheroidal (Slepian)
+tapers with time-bandwidth product NW, cached. They are the eigenvectors of
+the usual symmetric tridiagonal matrix with the largest eigenvalues.
+"""
+def dpss(length, NW, numTapers):
+
+   key = (length, float(NW), numTapers)
+   if key not in _tapers:
+      n = np.arange(length)
+      diagonal = np.square((length - 1 - 2 * n) / 2.) * np.cos(2 * np.pi * NW / length)
+      offDiagonal = n[1:] * (length - n[1:]) / 2.
+      matrix = np.diag(diagonal) + np.diag(offDiagonal, 1) + np.diag(offDiagonal, -1)
+      eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+      tapers = eigenvectors[:, ::-1][:, :numTapers].T
+      # conventional signs: symmetric tapers sum to a positive value, and
+      # antisymmetric ones start with a positive lobe
+      for order, taper in enumerate(tapers):
+         if order % 2 == 0:
+            if taper.sum() < 0:
+               taper *= -1
+         elif taper[np.abs(taper) > 1e-7 * np.abs(taper).max()][0] < 0:
+            taper *= -1
+      _tapers[key] = tapers
+   return _tapers[key]
+
+"""
+Converts the squared magnitude of a one-sided FFT of length samples into a
+power spectral density, by scaling and doubling every term without a
+negative frequency counterpart.
+"""
+def _oneSidedDensity(power, length, scale):
+
+   power *= scale
+   if length % 2 == 0:
+      power[..., 1:-1] *= 2
+   else:
+      power[..., 1:] *= 2
+   return power
+
+"""
+Estimates the power spectral density of every series along the last axis of
+signals with Welch's method: the mean periodogram of windowed, mean-removed
+segments of segmentLength samples (by default the whole signal / 4),
+overlapping by the given fraction. Segments are strided views, so nothing is
+copied before windowing.
+Returns:
+    psd, with shape [..., frequencies]
+    frequencies
+"""
+def welch(signals, sampleRate, segmentLength=None, overlap=0.5, windowName='hann',
+          lowCutoff=None, highCutoff=None):
+
+   signals = np.asanyarray(signals)
+   length = signals.shape[-1]
+   if segmentLength == None:
+      segmentLength = max(1, length / 4)
+   if segmentLength > length:
+      raise ValueError("segmentLength must not exceed the signal length")
+   step = max(1, int(segmentLength * (1 - overlap)))
+   segmentCount = (length - segmentLength) / step + 1
+
+   segments = np.lib.stride_tricks.as_strided(signals,
+         shape=signals.shape[:-1] + (segmentCount, segmentLength),
+         strides=signals.strides[:-1] + (step * signals.strides[-1], signals.strides[-1]))
+   taper = window(windowName, segmentLength)
+   segments = (segments - segments.mean(axis=-1)[..., np.newaxis]) * taper
+   power = np.square(np.abs(np.fft.rfft(segments, axis=-1))).mean(axis=-2)
+   psd = _oneSidedDensity(power, segmentLength, 1. / (sampleRate * np.square(taper).sum()))
+
+   band = bandSlice(segmentLength, sampleRate, lowCutoff, highCutoff)
+   return psd[..., band], frequencies(segmentLength, sampleRate)[band]
+
+"""
+Estimates the power spectral density of every series along the last axis of
+signals with the multitaper method: the mean of the periodograms of the
+signal under each of numTapers (by default 2NW - 1) DPSS tapers.
+Returns:
+    psd, with shape [..., frequencies]
+    frequencies
+"""
+def multitaper(signals, sampleRate, NW=4, numTapers=None, lowCutoff=None, highCutoff=None):
+
+   signals = np.asanyarray(signals)
+   length = signals.shape[-1]
+   if numTapers == None:
+      numTapers = int(2 * NW) - 1
+   tapers = dpss(length, NW, numTapers)
+   tapered = (signals - signals.mean(axis=-1)[..., np.newaxis])[..., np.newaxis, :] * tapers
+   power = np.square(np.abs(np.fft.rfft(tapered, axis=-1))).mean(axis=-2)
+   psd = _oneSidedDensity(power, length, 1. / sampleRate)
+
+   band = bandSlice(length, sampleRate, lowCutoff, highCutoff)
+   return psd[..., band], frequencies(length, sampleRate)[band]
+
+# Conventional EEG frequency bands, in Hertz, as (name, (low, high)) pairs.
+EEG_BANDS = [('delta', (0.5, 4)),
+             ('theta', (4, 8)),
+             ('alpha', (8, 13)),
+             ('beta',  (13, 30)),
+             ('gamma', (30, 100))]
+
+"""
+Returns the (starts, stops) index arrays splitting a length element spectrum
+into numBins contiguous bins whose sizes differ by at most one element.
+"""
+def binIndices(length, numBins):
+
+   key = (length, numBins)
+   if key not in _binIndices:
+      edges = np.arange(numBins + 1) * length / numBins
+      _binIndices[key] = (edges[:-1], edges[1:])
+   return _binIndices[key]
+
+"""
+Maps frequency bands onto (starts, stops) index arrays into a spectrum with
+the given (non-decreasing) frequency labels, such as those returned by
+solveSpectrum, welch or multitaper. Bands may be given as (name, (low, high))
+pairs like EEG_BANDS, or as a list of increasing band edges. Each band covers
+low <= f < high; a high of None extends to the end of the spectrum. The result
+is cached per frequency grid and band list.
+"""
+def bandIndices(freqs, bands=EEG_BANDS):
+
+   if len(bands) and np.isscalar(bands[0]):
+      bands = zip(bands[:-1], bands[1:])
+   else:
+      bands = [band for name, band in bands]
+
+   key = (freqs.tostring(), tuple(bands))
+   if key not in _bandIndices:
+      lows = [low for low, high in bands]
+      highs = [high if high != None else np.inf for low, high in bands]
+      starts = np.searchsorted(freqs, lows, side='left')
+      stops = np.maximum(starts, np.searchsorted(freqs, highs, side='left'))
+      _bandIndices[key] = (starts, stops)
+   return _bandIndices[key]
+
+"""
+Reduces the last axis of spectra to one value per band, given as the
+(starts, stops) index arrays of bandIndices or binIndices, by summing (or
+averaging) the elements of each band. Every band of a whole batch is computed
+at once from the cumulative sum, so bands may be uneven, overlapping or
+separated by gaps. Empty bands sum to 0 (their mean is NaN).
+"""
+def bandPower(spectra, starts, stops, method='sum'):
+
+   spectra = np.asanyarray(spectra)
+   cumulative = np.zeros(spectra.shape[:-1] + (spectra.shape[-1] + 1,),
+                         dtype=np.result_type(spectra.dtype, np.float64))
+   np.cumsum(spectra, axis=-1, out=cumulative[..., 1:])
+   sums = cumulative[..., stops] - cumulative[..., starts]
+   if method == 'sum':
+      return sums
+   elif method == 'mean':
+      with np.errstate(invalid='ignore', divide='ignore'):
+         return sums / (stops - starts)
+   else:
+      raise ValueError("Method must be one of 'sum' or 'mean'")
+
+"""
+Calculates the root of the sum of squares (despite the name, not divided by
+the number of samples) of a given signal, or of every series along axis.
 """
-def RMS(signal):
-    return np.sqrt(np.square(signal).sum())
+def RMS(signal, axis=None):
+    signal = np.asanyarray(signal)
+    if axis is None:
+        signal = signal.ravel()
+        axis = -1
+    elif axis != -1 and axis != signal.ndim - 1:
+        signal = np.rollaxis(signal, axis, signal.ndim)
+    return np.sqrt(np.einsum('...i,...i->...', signal, signal))
 
 """
 Normalises signal by centring it around 0 and correcting for expected deviation.
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Generator based feature pipeline, for datasets too large to hold every
+subject's features (or raw data) in memory at once.
+
+Stages are chained on top of ExperimentData.iterEpochs, which yields views
+into the recordings without copying them, e.g.:
+   chunks = stream.chunkEpochs(data.iterEpochs(), 256)
+   features = stream.spectralFeatures(chunks, 32)
+   stream.feed(stream.scale(features, scaler), learner.partial_fit)
+Only one chunk of epochs is materialised at any time, so memory use is flat
+regardless of the size of the dataset.
+"""
+
+import numpy
+import spectrum
+
+def chunkEpochs(epochs, chunkSize):
+   """
+   Groups the (subject, condition, epochIndex, view) tuples of an epoch
+   iterator into chunks of at most chunkSize epochs. Yields
+   (epochs, classes) pairs, where epochs is a [epoch, channel, sample] array.
+   A chunk is also cut short wherever the epoch shape changes.
+   """
+   views = []
+   classes = []
+   for subject, condition, epochIndex, view in epochs:
+      if views and (len(views) == chunkSize or view.shape != views[0].shape):
+         yield numpy.array(views), numpy.array(classes)
+         views = []
+         classes = []
+      views.append(view)
+      classes.append(condition)
+   if views:
+      yield numpy.array(views), numpy.array(classes)
+
+def spectralFeatures(chunks, numBins):
+   """
+   Yields (sample, classes) chunks where sample holds the
+   [epoch, channel, frequency bucket] spectra of each chunk of epochs, as
+   produced by SignalLearn.getSpectralDecompArray.
+   """
+   for epochs, classes in chunks:
+      # the sample rate only affects the discarded frequency labels
+      spectra, freqs = spectrum.solveSpectra(epochs, 1.)
+      yield spectrum.binSpectra(spectra, numBins, method = 'sum'), classes
+
+def rmsFeatures(chunks):
+   """
+   Yields (sample, classes) chunks where sample holds the [epoch, channel]
+   RMS values of each chunk of epochs, as produced by SignalLearn.getRmsList.
+   """
+   for epochs, classes in chunks:
+      yield spectrum.RMS(epochs, axis = -1), classes
+
+class RunningScaler:
+   """
+   Standardises features to zero mean and unit variance, with statistics
+   accumulated one chunk at a time (Chan et al.'s pairwise update), so that
+   they can be gathered in one streaming pass and applied in another.
+   """
+
+   def __init__(self):
+      self.count = 0
+      self.mean = None
+      self._sumSquares = None
+
+   def partial_fit(self, sample, classes = None):
+      flat = sample.reshape((len(sample), -1))
+      count = len(flat)
+      mean = flat.mean(axis = 0)
+      sumSquares = numpy.square(flat - mean).sum(axis = 0)
+      if self.count == 0:
+         self.mean, self._sumSquares = mean, sumSquares
+      else:
+         total = self.count + count
+         delta = mean - self.mean
+         self.mean = self.mean + delta * count / total
+         self._sumSquares = self._sumSquares + sumSquares + \
+               numpy.square(delta) * self.count * count / total
+      self.count += count
+
+   def std(self):
+      std = numpy.sqrt(self._sumSquares / self.count)
+      std[std == 0] = 1.
+      return std
+
+   def transform(self, sample):
+      flat = sample.reshape((len(sample), -1))
+      return ((flat - self.mean) / self.std()).reshape(sample.shape)
+
+def fitScaler(chunks, scaler = None):
+   """
+   Accumulates statistics over every (sample, classes) chunk into scaler (a
+   new RunningScaler if None), and returns it.
+   """
+   if scaler == None:
+      scaler = RunningScaler()
+   for sample, classes in chunks:
+      scaler.partial_fit(sample)
+   return scaler
+
+def scale(chunks, scaler):
+   """
+   Yields each (sample, classes) chunk standardised by a fitted scaler.
+   """
+   for sample, classes in chunks:
+      yield scaler.transform(sample), classes
+
+def feed(chunks, partialFit):
+   """
+   Passes every (sample, classes) chunk, flattened to [epoch, features], to
+   an online learner's partialFit(sample, classes) method. Returns the number
+   of epochs consumed.
+   """
+   count = 0
+   for sample, classes in chunks:
+      partialFit(sample.reshape((len(sample), -1)), classes)
+      count += len(sample)
+   return count
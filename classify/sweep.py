@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Hyperparameter sweeps of per-subject spectral cross-validation, i.e. the
+equivalent of calling testModules.runSpectralCrossValidation for every
+combination of a grid of bins, learners and k, without repeating work
+shared between combinations:
+
+ - each subject's full-resolution spectra are computed once, and every bins
+   value is derived from them by re-binning (spectrum.binSpectra);
+ - the folds for each subject and k are built once and shared by every bins
+   value and learner;
+ - the individual (bins, learner, k, fold) jobs of a subject are spread over
+   a pool of worker processes (see parallel.forkMap).
+
+The confusion matrix of every finished job is appended to a results file,
+one JSON record per line, as soon as it is available. Jobs already recorded
+there are skipped, so an interrupted sweep resumes where it stopped when run
+again with the same results file. For example:
+   grid = {'bins':     [8, 16, 32],
+           'learners': {'LinearSVC C=0.1': svm.LinearSVC(C = 0.1),
+                        'LinearSVC C=1':   svm.LinearSVC(C = 1)},
+           'k':        [5, 10]}
+   sweep.runSweep(data, grid, 'sweep.jsonl', workers = 4)
+   summary = sweep.summarise('sweep.jsonl')
+"""
+
+import signalLearning
+import spectrum
+import parallel
+import metrics
+import scikits.learn.cross_val as cross_val
+import numpy
+import json
+import os
+import time
+
+def _folds(classes, validator, k):
+   """
+   Returns the (train indices, test indices) pairs of validator
+   ('stratified', 'kfold' or 'leaveOneOut', which ignores k) over classes.
+   """
+   if validator == 'stratified':
+      crossValMatrix = cross_val.StratifiedKFold(classes, k)
+   elif validator == 'kfold':
+      crossValMatrix = cross_val.KFold(len(classes), k)
+   elif validator == 'leaveOneOut':
+      crossValMatrix = cross_val.LeaveOneOut(len(classes))
+   else:
+      raise ValueError("validator must be one of 'stratified', 'kfold' or 'leaveOneOut'")
+   folds = []
+   for trainIndex, testIndex in crossValMatrix:
+      folds.append((_asIndices(trainIndex), _asIndices(testIndex)))
+   return folds
+
+def _asIndices(index):
+   index = numpy.asanyarray(index)
+   if index.dtype == bool:
+      return numpy.flatnonzero(index)
+   return index
+
+def _key(record):
+   return (record['subject'], record['validator'], record['bins'], record['learner'],
+           record['k'], record['fold'])
+
+def loadResults(resultsFile):
+   """
+   Returns the records of a sweep results file (an empty list if there is
+   none yet). An incomplete final line, left by an interrupted sweep, is
+   ignored.
+   """
+   records = []
+   if not os.path.exists(resultsFile):
+      return records
+   for line in open(resultsFile):
+      if not line.endswith('\n'):
+         break
+      records.append(json.loads(line))
+   return records
+
+def _openResults(resultsFile):
+   """
+   Opens a results file for appending, first truncating any incomplete
+   final line so that new records start on a line of their own.
+   """
+   if os.path.exists(resultsFile):
+      results = open(resultsFile, 'r+')
+      complete = 0
+      for line in iter(results.readline, ''):
+         if not line.endswith('\n'):
+            break
+         complete = results.tell()
+      results.seek(complete)
+      results.truncate()
+      results.close()
+   return open(resultsFile, 'a')
+
+def _runJob(context, job):
+   """
+   Trains and tests the learner of a single (bins, learner name, k, fold)
+   job. Returns the job and the confusion matrix of its test set.
+   """
+   samples, classes, labels, folds, learners = context
+   bins, name, k, fold = job
+   trainIndex, testIndex = folds[k][fold]
+   sample = samples[bins]
+   learner = learners[name]
+   learner.fit(sample[trainIndex], classes[trainIndex])
+   results = learner.predict(sample[testIndex])
+   return job, metrics.confusionMatrix(results, classes[testIndex], labels)
+
+def runSweep(data, grid, resultsFile, validator = 'stratified', subjectIndices = None,
+             workers = 1, featureCache = None):
+   """
+   Cross-validates every combination of grid['bins'], grid['learners'] (a
+   dict of name -> learner object with fit and predict methods) and grid['k']
+   (optional, default [10]) on the spectral features of each subject of the
+   ExperimentData data (or those in subjectIndices), recording the confusion
+   matrix of each fold in resultsFile. Jobs already in resultsFile are not
+   run again.
+
+   Jobs are spread over workers processes (None meaning one per CPU); with
+   workers == 1 they run serially. featureCache is passed on to SignalLearn,
+   so that spectra can also be reused between sweeps.
+   Returns the number of jobs run.
+   """
+   binsList = list(grid['bins'])
+   learners = grid['learners']
+   kList = list(grid.get('k', [10]))
+   if validator == 'leaveOneOut':
+      kList = [None]
+   if subjectIndices == None:
+      subjectIndices = range(len(data.matrix))
+
+   done = set([_key(record) for record in loadResults(resultsFile)])
+   sigLearnInstance = signalLearning.SignalLearn(featureCache)
+   results = _openResults(resultsFile)
+   jobTotal = 0
+   try:
+      for subject in subjectIndices:
+         classes = numpy.concatenate([[task.condition] * task.nEpochs
+                                      for task in data.matrix[subject] if task != None])
+         folds = dict([(k, _folds(classes, validator, k)) for k in kList])
+         jobs = [(bins, name, k, fold) for bins in binsList for name in sorted(learners)
+                 for k in kList for fold in range(len(folds[k]))
+                 if (subject, validator, bins, name, k, fold) not in done]
+         if not jobs:
+            continue
+
+         # features for every bins value from a single set of spectra
+         spectra, classes = sigLearnInstance.getFullSpectrumArray(data, subject)
+         samples = {}
+         for bins in set([job[0] for job in jobs]):
+            binned = spectrum.binSpectra(spectra, bins, method = 'sum')
+            samples[bins] = binned.reshape((len(binned), -1))
+         del spectra
+         labels = numpy.unique(classes)
+
+         print "Subject {0}: {1} jobs".format(subject + 1, len(jobs))
+         context = (samples, classes, labels, folds, learners)
+         progress = 0
+         progressGranularity = max(1, len(jobs) / 20)
+         for (bins, name, k, fold), confusion in parallel.forkMap(_runJob, context, jobs,
+               workers, ordered = False, chunkSize = parallel.chunkSizeFor(len(jobs), workers)):
+            record = {'subject': subject, 'validator': validator, 'bins': bins,
+                      'learner': name, 'k': k, 'fold': fold,
+                      'labels': labels.tolist(), 'confusion': confusion.tolist()}
+            results.write(json.dumps(record) + '\n')
+            results.flush()
+            progress += 1
+            if progress % progressGranularity == 0:
+               print "{0}: {1}/{2} done".format(time.strftime("%H:%M:%S"), progress, len(jobs))
+         jobTotal += len(jobs)
+   finally:
+      results.close()
+   return jobTotal
+
+def summarise(resultsFile):
+   """
+   Summarises a sweep results file per configuration, in the form returned
+   by testModules.runSpectralCrossValidation.
+
+   Returns a dict mapping each (validator, bins, learner, k) configuration to:
+   subjects           - the indices of the subjects with results
+   labels             - every class label found, in the order of the
+                        columns of classAccuracies
+   perSubjectAccuracy - the accuracy over every fold of each subject
+   classAccuracies    - a [subject x class] array of the fraction of folds
+                        in which most of each class was classified correctly
+                        (as the cross-validators of SignalLearn report), NaN
+                        for classes a subject does not have
+   Only the folds recorded so far are included.
+   """
+   grouped = {}
+   for record in loadResults(resultsFile):
+      config = (record['validator'], record['bins'], record['learner'], record['k'])
+      subjects = grouped.setdefault(config, {})
+      labels, folds = subjects.setdefault(record['subject'], (record['labels'], {}))
+      folds[record['fold']] = record['confusion']
+
+   summary = {}
+   for config, subjects in grouped.items():
+      indices = sorted(subjects)
+      allLabels = numpy.unique(numpy.concatenate([subjects[subject][0] for subject in indices]))
+      perSubjectAccuracy = numpy.zeros(len(indices))
+      classAccuracies = numpy.empty((len(indices), len(allLabels)))
+      classAccuracies.fill(numpy.nan)
+      for row, subject in enumerate(indices):
+         labels, folds = subjects[subject]
+         confusions = numpy.array([folds[fold] for fold in sorted(folds)])
+         perSubjectAccuracy[row] = metrics.accuracy(confusions.sum(axis = 0))
+         columns = numpy.searchsorted(allLabels, labels)
+         classAccuracies[row, columns] = metrics.foldSummary(metrics.classAccuracy(confusions))
+      summary[config] = {'subjects': indices,
+                         'labels': allLabels,
+                         'perSubjectAccuracy': perSubjectAccuracy,
+                         'classAccuracies': classAccuracies}
+   return summary
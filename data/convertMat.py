@@ -8,19 +8,42 @@ to a more useful data structure.
 
 import argparse
 import sys
+import os
+import json
 import cPickle
+import multiprocessing
 import scipy.io as sio
 import numpy
 
 # constants
 PICKLE_BINARY = 2
+CACHE_INDEX = 'index.json'
+CACHE_VERSION = 1
+# EEGLAB event type number -> event name
+EVENT_NAMES = {0:   'experimentStart',
+               1:   'experimentEnd',
+               3:   'slideStart',
+               4:   'slideEnd',
+               100: 'leftClick',
+               101: 'middleClick',
+               102: 'rightClick',
+               200: 'emotivBlink',
+               255: 'emotivError'
+              }
+EVENT_CODES = dict([(name, code) for code, name in EVENT_NAMES.items()])
+# events of compact TaskRecordings
+EVENT_DTYPE = [('latency', numpy.float64), ('code', numpy.int16), ('epoch', numpy.int32)]
 
 # Call ExperimentData(filename) to turn the .mat files into instances of this
 # class
 class ExperimentData:
    CONDITION_COUNT = 4
 
-   def __init__(self, alleegFilename = None):
+   def __init__(self, alleegFilename = None, compact = False):
+      """
+      Loads the given ALLEEG file, if any. With compact set, recordings are
+      stored in their compact form (see TaskRecording.compact).
+      """
       if (alleegFilename != None):
          matFile = sio.loadmat(alleegFilename, struct_as_record = True)
          alleeg = matFile['ALLEEG']
@@ -35,7 +58,7 @@ class ExperimentData:
          currentSubject = int(alleeg[0][0]['subject'][0])
          for record in alleeg[0]:
             # convert eeglab format to python class
-            newRecord = TaskRecording(record)
+            newRecord = TaskRecording(record, compact)
             # insert in matrix
             if newRecord.subject != currentSubject:
                currentSubject = newRecord.subject
@@ -49,6 +72,30 @@ class ExperimentData:
                task.splitEpochs(minEpochSize)
 
 
+   def compact(self):
+      """
+      Converts every recording to its compact form (see TaskRecording.compact).
+      """
+      for subject in self.matrix:
+         for task in subject:
+            if task != None:
+               task.compact()
+
+   def iterEpochs(self, subjectIndex = None):
+      """
+      Yields (subject, condition, epochIndex, view) for every epoch of every
+      recording (of the subject at subjectIndex only, if given), where view
+      is a [channel, sample] view into the recording's data; nothing is
+      copied.
+      """
+      for index, subject in enumerate(self.matrix):
+         if subjectIndex == None or index == subjectIndex:
+            for task in subject:
+               if task == None:
+                  continue
+               for epochIndex, view in task.iterEpochs():
+                  yield task.subject, task.condition, epochIndex, view
+
    # Not sure how these work yet...
    def loadData(self, filename):
       self.matrix = cPickle.load(open(filename, 'rb'))
@@ -56,11 +103,73 @@ class ExperimentData:
    def saveData(self, filename):
       cPickle.dump(self.matrix, open(filename, 'wb'), PICKLE_BINARY)
 
+   def saveCache(self, dirname):
+      """
+      Writes the dataset to dirname as one raw .npy array per TaskRecording,
+      plus a small JSON index holding every recording's metadata and its
+      position in the matrix.
+      """
+      if not os.path.isdir(dirname):
+         os.makedirs(dirname)
+      records = []
+      for subjectIndex, subject in enumerate(self.matrix):
+         for conditionIndex, task in enumerate(subject):
+            if task == None:
+               continue
+            arrayFile = 'subject{0}_condition{1}.npy'.format(subjectIndex, conditionIndex)
+            if task.source is None:
+               numpy.save(os.path.join(dirname, arrayFile), task.data)
+            else:
+               # epochs are re-derived from the source on loading
+               numpy.save(os.path.join(dirname, arrayFile), task.source)
+            entry = task._metadata()
+            entry['position'] = [subjectIndex, conditionIndex]
+            entry['file'] = arrayFile
+            records.append(entry)
+      _writeCacheIndex(dirname, len(self.matrix), self.CONDITION_COUNT, records)
+
+   def loadCache(self, dirname, mmapMode = 'r', compact = False):
+      """
+      Opens a dataset written by saveCache. Only the metadata index is read
+      up front; each recording's data is memory-mapped (unless mmapMode is
+      None), so samples are paged in from disk as they are first touched.
+      With compact set, recordings are converted to their compact form,
+      which reads any data not already stored as float32 into memory.
+      """
+      index = json.load(open(os.path.join(dirname, CACHE_INDEX)))
+      if index['version'] != CACHE_VERSION:
+         raise ValueError("Unsupported cache version {0}".format(index['version']))
+      self.matrix = [[None for condition in range(index['conditions'])]
+                     for subject in range(index['subjects'])]
+      for entry in index['records']:
+         task = TaskRecording()
+         task._setMetadata(entry)
+         data = numpy.load(os.path.join(dirname, entry['file']), mmap_mode = mmapMode)
+         if task.epochStep is None:
+            task.data = data
+         else:
+            task.source = data
+            task._applyEpochs()
+         if compact:
+            task.compact()
+         subjectIndex, conditionIndex = entry['position']
+         self.matrix[subjectIndex][conditionIndex] = task
+
 
 # TaskRecording contains the details and data associated with a single recording
 # i.e. one subject x task level unit.
-class TaskRecording:
-   def __init__(self, record):
+class TaskRecording(object):
+   __slots__ = ['subject', 'condition', 'nChans', 'chanLabels', 'epochSize', 'sampleRate',
+                'data', 'events', 'nEpochs', 'source', 'epochStep']
+
+   def __init__(self, record = None, compact = False):
+      # continuous channel x sample recording that self.data views into, and
+      # the step in seconds between epoch starts, once splitEpochs is called
+      self.source       = None
+      self.epochStep    = None
+      # an empty recording is filled in by ExperimentData.loadCache
+      if record == None:
+         return
       # subject id 
       self.subject      = int(record['subject'][0])
       # task condition
@@ -77,7 +186,7 @@ class TaskRecording:
       self.data         = record['data']
       # list of recorded "events", such as slide starts and mouse clicks during
       # the experiment. Latency is relative to the enire record, not the
-      # individual epoch.
+      # individual epoch. Compact recordings hold an EVENT_DTYPE array instead.
       self.events       = [ {'latency': event['latency'][0][0],
                              'name':    self._eventName(event['type'][0]),
                              'epoch':   event['epoch'][0][0]
@@ -86,39 +195,188 @@ class TaskRecording:
          self.nEpochs = 1
       else:
          self.nEpochs = self.data.shape[2]
+      if compact:
+         self.compact()
+
+   def __getstate__(self):
+      return dict([(name, getattr(self, name)) for name in self.__slots__
+                   if hasattr(self, name)])
+
+   def __setstate__(self, state):
+      # also accepts the __dict__ of recordings pickled before __slots__
+      self.source = None
+      self.epochStep = None
+      for name, value in state.items():
+         setattr(self, name, value)
+
+   def compact(self):
+      """
+      Converts the recording to a compact form taking about half the memory,
+      in place: samples are stored as float32, and events as a structured
+      EVENT_DTYPE array with integer event codes instead of a list of dicts.
+      """
+      if self.source is not None:
+         if self.source.dtype != numpy.float32:
+            self.source = self.source.astype(numpy.float32)
+         self._applyEpochs()
+      elif self.data.dtype != numpy.float32:
+         self.data = self.data.astype(numpy.float32)
+      if not isinstance(self.events, numpy.ndarray):
+         self.events = numpy.array([(latency, EVENT_CODES[name], epoch)
+                                    for latency, name, epoch in self._eventRecords()],
+                                   dtype = EVENT_DTYPE)
+
+   def _eventRecords(self):
+      """
+      Returns a (latency, name, epoch) tuple per event, whichever form the
+      events are stored in.
+      """
+      if isinstance(self.events, numpy.ndarray):
+         return [(float(event['latency']), EVENT_NAMES[int(event['code'])], int(event['epoch']))
+                 for event in self.events]
+      return [(event['latency'], event['name'], event['epoch']) for event in self.events]
 
-   #def epochEvents(self, epoch):
-    #  if (epoch >= len(self.epoch
+   def iterEpochs(self):
+      """
+      Yields (epochIndex, view) for each epoch, where view is a
+      [channel, sample] view into self.data.
+      """
+      if self.data.ndim == 2:
+         yield 0, self.data
+      else:
+         for epoch in range(self.nEpochs):
+            yield epoch, self.data[:, :, epoch]
+
+   def splitEpochs(self, epochSize, step = None):
+      """
+      Splits the recording into epochs of epochSize seconds, starting every
+      step seconds (by default epochSize, giving non-overlapping epochs), and
+      remaps each event's 'epoch' to the first epoch containing it (1-based,
+      as in EEGLAB, or 0 if it falls in samples trimmed from the end).
 
-   def splitEpochs(self, epochSize):
+      The new epochs are strided views onto the continuous recording, so no
+      samples are copied however much the epochs overlap. The continuous
+      recording is kept as self.source, and later splits start from it.
+      """
       assert(epochSize > 0)
-      
-      if (epochSize < self.epochSize):
-         newEpochSampleCount = int(epochSize * self.sampleRate)
-         newEpochCount = self.data[0].size / newEpochSampleCount
-         if newEpochSampleCount * newEpochCount != self.data[0].size:
-            if (self.data.ndim > 2):
-               self.data = self.data[:, :-(self.data.shape[1] % newEpochSampleCount), :]
+      if step == None:
+         step = epochSize
+      assert(step > 0)
+
+      if epochSize < self.epochSize or step < epochSize:
+         if self.source is None:
+            # recorded epochs are treated as one continuous recording
+            if self.data.ndim > 2:
+               self.source = self.data.reshape((self.data.shape[0], -1), order = 'F')
             else:
-               self.data = self.data[:, :-(self.data.shape[1] % newEpochSampleCount)]
-         self.data = self.data.reshape((self.data.shape[0], newEpochSampleCount, newEpochCount))
+               self.source = self.data
          self.epochSize = epochSize
-         self.nEpochs = newEpochCount
-         # TODO: implement event['epoch'] updating
+         self.epochStep = step
+         self._applyEpochs()
+         first, last = self._eventEpochRanges()
+         epochs = numpy.where(first <= last, first + 1, 0)
+         if isinstance(self.events, numpy.ndarray):
+            self.events['epoch'] = epochs
+         else:
+            for event, epoch in zip(self.events, epochs):
+               event['epoch'] = int(epoch)
 
-   def _eventName(self, event): # internal event number -> name mapping
-      nameDic = {'0': 'experimentStart',
-                 '1': 'experimentEnd',
-                 '3': 'slideStart',
-                 '4': 'slideEnd',
-                 '100': 'leftClick',
-                 '101': 'middleClick',
-                 '102': 'rightClick',
-                 '200': 'emotivBlink',
-                 '255': 'emotivError'
-                }
+   def _epochSampleCounts(self):
+      """
+      Returns the number of samples in, and between the starts of, each epoch.
+      """
+      return int(self.epochSize * self.sampleRate), int(self.epochStep * self.sampleRate)
+
+   def _applyEpochs(self):
+      """
+      Sets self.data to a [channel, sample, epoch] strided view of self.source
+      according to self.epochSize and self.epochStep.
+      """
+      epochSamples, stepSamples = self._epochSampleCounts()
+      channels, sampleTotal = self.source.shape
+      assert(0 < epochSamples <= sampleTotal and stepSamples > 0)
+      self.nEpochs = (sampleTotal - epochSamples) / stepSamples + 1
+      channelStride, sampleStride = self.source.strides
+      self.data = numpy.lib.stride_tricks.as_strided(self.source,
+            shape = (channels, epochSamples, self.nEpochs),
+            strides = (channelStride, sampleStride, stepSamples * sampleStride))
+
+   def _eventEpochRanges(self):
+      """
+      Returns the (0-based) indices of the first and last epochs containing
+      each event, as two arrays. Where first > last, no epoch contains it.
+      """
+      if isinstance(self.events, numpy.ndarray):
+         latencies = self.events['latency']
+      else:
+         latencies = numpy.array([event['latency'] for event in self.events], dtype = float)
+      samples = (latencies - 1).astype(int)
+      if self.epochStep is None:
+         # recorded epochs are consecutive and non-overlapping
+         epochSamples = stepSamples = self.data.shape[1]
+      else:
+         epochSamples, stepSamples = self._epochSampleCounts()
+      first = numpy.maximum(0, -(-(samples - epochSamples + 1) // stepSamples))
+      last = numpy.minimum(self.nEpochs - 1, samples // stepSamples)
+      return first, last
+
+   def epochEvents(self, epoch):
+      """
+      Returns the events falling within the given (0-based) epoch.
+      """
+      first, last = self._eventEpochRanges()
+      inEpoch = (first <= epoch) & (epoch <= last)
+      if isinstance(self.events, numpy.ndarray):
+         return self.events[inEpoch]
+      return [event for event, include in zip(self.events, inEpoch) if include]
+
+   def eventEpochs(self, name):
+      """
+      Returns the sorted (0-based) indices of the epochs containing at least
+      one event with the given name, e.g. 'slideStart' or 'leftClick'.
+      """
+      first, last = self._eventEpochRanges()
+      epochs = [numpy.arange(start, stop + 1)
+                for (latency, eventName, epoch), start, stop
+                in zip(self._eventRecords(), first, last) if eventName == name]
+      if not epochs:
+         return numpy.array([], dtype = int)
+      return numpy.unique(numpy.concatenate(epochs))
 
-      return(nameDic[event])
+   def _metadata(self):
+      """
+      Returns everything but the data array as a JSON-serialisable dict.
+      """
+      return {'subject':    int(self.subject),
+              'condition':  int(self.condition),
+              'nChans':     int(self.nChans),
+              'chanLabels': [str(label) for label in self.chanLabels],
+              'epochSize':  float(self.epochSize),
+              'sampleRate': float(self.sampleRate),
+              'nEpochs':    int(self.nEpochs),
+              'epochStep':  None if self.epochStep is None else float(self.epochStep),
+              'events':     [{'latency': float(latency),
+                              'name':    str(name),
+                              'epoch':   int(epoch)
+                             } for latency, name, epoch in self._eventRecords()]
+             }
+
+   def _setMetadata(self, metadata):
+      self.subject    = metadata['subject']
+      self.condition  = metadata['condition']
+      self.nChans     = metadata['nChans']
+      self.chanLabels = [str(label) for label in metadata['chanLabels']]
+      self.epochSize  = metadata['epochSize']
+      self.sampleRate = metadata['sampleRate']
+      self.nEpochs    = metadata['nEpochs']
+      self.epochStep  = metadata.get('epochStep')
+      self.events     = [{'latency': event['latency'],
+                          'name':    str(event['name']),
+                          'epoch':   event['epoch']
+                         } for event in metadata['events']]
+
+   def _eventName(self, event): # internal event number -> name mapping
+      return(EVENT_NAMES[int(event)])
 
    def _taskNameToInt(self, taskName): # internal task name -> index mapping
       taskDic = {'open': 0,
@@ -129,20 +387,180 @@ class TaskRecording:
       return(taskDic[taskName])
 
 
+def _writeCacheIndex(dirname, subjects, conditions, records):
+   # the index is written last, so an interrupted save is never loadable
+   index = {'version': CACHE_VERSION,
+            'subjects': subjects,
+            'conditions': conditions,
+            'records': records}
+   json.dump(index, open(os.path.join(dirname, CACHE_INDEX), 'w'), indent = 1)
+
+def _loadRecords(filename):
+   """
+   Returns the EEG records held in an EEGLAB .mat/.set file, as either an
+   ALLEEG struct array or a single EEG struct. Sample data that EEGLAB keeps
+   in a separate .fdt file is memory-mapped rather than read into memory.
+   """
+   matFile = sio.loadmat(filename, struct_as_record = True)
+   if 'ALLEEG' in matFile:
+      records = matFile['ALLEEG'][0]
+   else:
+      records = matFile['EEG'][0]
+   for record in records:
+      if record['data'].dtype.kind in 'SU':
+         dataFile = os.path.join(os.path.dirname(filename), str(record['data'][0]))
+         channels, samples = int(record['nbchan'][0][0]), int(record['pnts'][0][0])
+         trials = int(record['trials'][0][0])
+         shape = (channels, samples, trials) if trials > 1 else (channels, samples)
+         record['data'] = numpy.memmap(dataFile, dtype = '<f4', mode = 'r',
+                                       shape = shape, order = 'F')
+   return records
+
+def _ingestFile(job):
+   """
+   Converts every record of one file to a TaskRecording and writes its data
+   straight to the cache directory, releasing it before the next record.
+   Returns the records' cache index entries (without matrix positions).
+   """
+   dirname, fileNumber, filename, compact = job
+   entries = []
+   for recordNumber, record in enumerate(_loadRecords(filename)):
+      task = TaskRecording(record, compact)
+      arrayFile = 'file{0}_record{1}.npy'.format(fileNumber, recordNumber)
+      numpy.save(os.path.join(dirname, arrayFile), task.data)
+      entry = task._metadata()
+      entry['file'] = arrayFile
+      entries.append(entry)
+      del task
+      record['data'] = None
+   return entries
+
+def ingest(filenames, dirname, workers = 1, epochSize = None, compact = False):
+   """
+   Converts EEGLAB data straight into the on-disk cache format of
+   ExperimentData.saveCache, and returns the memory-mapped ExperimentData.
+
+   filenames is either a single ALLEEG .mat file, or a list of files with
+   one EEG struct (or ALLEEG array) each, such as per-subject .set files,
+   given in subject order. The files are converted across workers processes
+   (None for one per CPU), one file per process at a time. scipy.io reads a
+   whole .mat file at once, so bounded memory and parallelism only come from
+   per-recording input: a single ALLEEG file is read whole by one process,
+   taking as much memory as ExperimentData.__init__ does, while each .set
+   file holds one record (and its .fdt samples are memory-mapped), so memory
+   use is bounded by a few records. As in ExperimentData.__init__, every
+   recording is then split into epochs of the smallest epoch size found,
+   unless epochSize is given; only the cache index needs rewriting for this,
+   except for recordings EEGLAB had already epoched, whose continuous
+   samples are rewritten. With compact
+   set, samples are written as float32 and the recordings returned in their
+   compact form.
+   """
+   if isinstance(filenames, basestring):
+      filenames = [filenames]
+   if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+   jobs = [(dirname, fileNumber, filename, compact)
+           for fileNumber, filename in enumerate(filenames)]
+   if workers == 1:
+      converted = map(_ingestFile, jobs)
+   else:
+      pool = multiprocessing.Pool(workers)
+      try:
+         converted = pool.map(_ingestFile, jobs, 1)
+      finally:
+         pool.terminate()
+   entries = [entry for fileEntries in converted for entry in fileEntries]
+
+   if epochSize == None:
+      epochSize = min([entry['epochSize'] for entry in entries])
+   subjectCount = 0
+   currentSubject = entries[0]['subject']
+   for position, entry in enumerate(entries):
+      if entry['subject'] != currentSubject:
+         currentSubject = entry['subject']
+         subjectCount += 1
+      if epochSize < entry['epochSize']:
+         task = TaskRecording()
+         task._setMetadata(entry)
+         arrayFile = os.path.join(dirname, entry['file'])
+         task.data = numpy.load(arrayFile, mmap_mode = 'r')
+         recorded = task.data.ndim > 2
+         task.splitEpochs(epochSize)
+         if recorded:
+            # as in saveCache, the continuous source is stored rather than the
+            # recorded epochs; written aside first, as arrayFile is still mapped
+            numpy.save(arrayFile + '.tmp.npy', task.source)
+            os.rename(arrayFile + '.tmp.npy', arrayFile)
+         entries[position] = entry = dict(task._metadata(), file = entry['file'])
+      entry['position'] = [subjectCount, entry['condition']]
+   _writeCacheIndex(dirname, subjectCount + 1, ExperimentData.CONDITION_COUNT, entries)
+
+   data = ExperimentData()
+   data.loadCache(dirname, compact = compact)
+   return data
+
+def epochCache(sourceDirname, dirname, epochSize, step = None):
+   """
+   Writes a cache index to dirname holding the recordings of the cache at
+   sourceDirname split into epochs (see TaskRecording.splitEpochs). Its
+   entries refer to sourceDirname's arrays rather than copying them, so
+   sourceDirname must be kept alongside it; only recordings EEGLAB had
+   already epoched, and that are split further, have their continuous
+   samples written to dirname.
+   """
+   if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+   index = json.load(open(os.path.join(sourceDirname, CACHE_INDEX)))
+   if index['version'] != CACHE_VERSION:
+      raise ValueError("Unsupported cache version {0}".format(index['version']))
+   entries = []
+   for entry in index['records']:
+      task = TaskRecording()
+      task._setMetadata(entry)
+      data = numpy.load(os.path.join(sourceDirname, entry['file']), mmap_mode = 'r')
+      if task.epochStep is None:
+         task.data = data
+      else:
+         task.source = data
+         task._applyEpochs()
+      task.splitEpochs(epochSize, step)
+      if data.ndim > 2 and task.source is not None:
+         # recordings EEGLAB had already epoched have no continuous array to
+         # refer to once split, so theirs is written out here
+         arrayFile = os.path.basename(entry['file'])
+         numpy.save(os.path.join(dirname, arrayFile), task.source)
+      else:
+         arrayFile = os.path.relpath(os.path.join(sourceDirname, entry['file']), dirname)
+      entries.append(dict(task._metadata(), file = arrayFile, position = entry['position']))
+   _writeCacheIndex(dirname, index['subjects'], index['conditions'], entries)
+
 def main(*args):
    """
-   This doesn't work, yet. Just use ExperimentData.__init__ from another module
-   or interactive session.
+   Converts an ALLEEG .mat file to a pickled ExperimentData, or EEGLAB files
+   to the memory-mappable cache format (see ingest). To run the rest of the
+   pipeline from the command line as well, see pipeline.py.
    """
    parser = argparse.ArgumentParser(
          description = 'Convert eeglab ALLEEG structure from .mat to pickled python.')
-   parser.add_argument('inputFile')
-   parser.add_argument('outputFile')
+   parser.add_argument('inputFiles', nargs = '+',
+         help = 'ALLEEG .mat file, or (cache format only) per-recording .mat/.set files')
+   parser.add_argument('outputFile',
+         help = 'output file, or output directory for the cache format')
+   parser.add_argument('--format', choices = ['pickle', 'cache'], default = 'pickle',
+         help = 'pickled matrix, or memory-mappable .npy cache directory')
+   parser.add_argument('--workers', type = int, default = 1,
+         help = 'processes converting input files in parallel (cache format only)')
    argsParsed = parser.parse_args(args[1:])
    
    import convertMat # required for pickle to correctly isolate the class from main
-   data = convertMat.ExperimentData(argsParsed.inputFile)
-   data.saveData(argsParsed.outputFile)
+   if argsParsed.format == 'cache':
+      convertMat.ingest(argsParsed.inputFiles, argsParsed.outputFile, argsParsed.workers)
+   else:
+      if len(argsParsed.inputFiles) != 1:
+         parser.error('the pickle format takes a single ALLEEG file')
+      data = convertMat.ExperimentData(argsParsed.inputFiles[0])
+      data.saveData(argsParsed.outputFile)
 
 if __name__ == "__main__":
    main(*sys.argv)
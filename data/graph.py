@@ -1,21 +1,63 @@
 #!/usr/bin/env python
 
+"""
+Plots an embedding produced by classify.projection, coloured by class.
+Embeddings of 1, 2 or 3 components are drawn as strip, scatter and 3D
+scatter plots respectively, for any number of examples and classes.
+
+Usage: graph.py <datafile> [classes]
+
+datafile is either an .npz file written by projection.saveEmbedding, which
+holds its own class labels, or one of the older text files in data/cache
+(components x examples), whose examples are split into the given number of
+equally sized, consecutive classes (3 by default).
+"""
+
 import numpy as np
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
 import sys
 
+COLOURS = ['r', 'g', 'b', 'c', 'm', 'y', 'k']
+
+def loadEmbedding(filename, classCount = 3):
+    """
+    Returns the [example, component] embedding and class labels in filename.
+    """
+    if filename.endswith('.npz'):
+        archive = np.load(filename)
+        return archive['embedding'], archive['classes']
+    data = np.loadtxt(filename)
+    embedding = data.reshape((-1, data.shape[-1])).T
+    classes = np.arange(len(embedding)) * classCount / len(embedding)
+    return embedding, classes
 
-if len(sys.argv) != 2:
-    print "Usage: graph.py <datafile>\n"
-    sys.exit(0)
+def plotEmbedding(embedding, classes):
+    fig = plt.figure()
+    if embedding.shape[1] >= 3:
+        ax = fig.add_subplot(111, projection='3d')
+    else:
+        ax = fig.add_subplot(111)
+    for index, label in enumerate(np.unique(classes)):
+        points = embedding[classes == label]
+        colour = COLOURS[index % len(COLOURS)]
+        if embedding.shape[1] >= 3:
+            ax.scatter(points[:, 0], points[:, 1], points[:, 2], c=colour, label=str(label))
+        elif embedding.shape[1] == 2:
+            ax.scatter(points[:, 0], points[:, 1], c=colour, label=str(label))
+        else:
+            ax.scatter(points[:, 0], np.zeros(len(points)), c=colour, label=str(label))
+    ax.legend()
+    return fig
 
-fig = plt.figure()
-ax = fig.add_subplot(111, projection='3d')
-data = np.loadtxt(sys.argv[1])
-assert(data.shape == (3,54))
-ax.scatter(data[0,0:17], data[1,0:17], data[2,0:17], c='r')
-ax.scatter(data[0,18:35], data[1,18:35], data[2,18:35], c='g')
-ax.scatter(data[0,35:], data[1,35:], data[2,35:], c='b')
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        print "Usage: graph.py <datafile> [classes]\n"
+        sys.exit(0)
 
-plt.show()
+    if len(sys.argv) == 3:
+        embedding, classes = loadEmbedding(sys.argv[1], int(sys.argv[2]))
+    else:
+        embedding, classes = loadEmbedding(sys.argv[1])
+    plotEmbedding(embedding, classes)
+    plt.show()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+"""
+Generates synthetic EEGLAB data in the same layout as our real exports, for
+benchmarking and for exercising the pipeline without the private recordings.
+
+Each recording is gaussian noise plus a sinusoid whose frequency depends on
+the task condition, so that conditions are separable by spectral features.
+"""
+
+import os
+import numpy
+import scipy.io as sio
+from data.convertMat import ExperimentData, TaskRecording, EVENT_NAMES
+
+CONDITION_NAMES = ['open', '1', '2', '3']
+# EEGLAB event type codes for the events placed in every recording
+EVENT_TYPES = ['0', '3', '100', '4', '1']
+
+def _chanlocs(channels):
+   chanlocs = numpy.zeros((1, channels), dtype = [('labels', object)])
+   for channel in range(channels):
+      chanlocs[0, channel]['labels'] = 'C{0}'.format(channel + 1)
+   return chanlocs
+
+def _eventLatencies(samples):
+   return numpy.linspace(1, samples, len(EVENT_TYPES))
+
+def _events(samples):
+   events = numpy.zeros((1, len(EVENT_TYPES)),
+                        dtype = [('latency', object), ('type', object), ('epoch', object)])
+   latencies = _eventLatencies(samples)
+   for index, (latency, eventType) in enumerate(zip(latencies, EVENT_TYPES)):
+      events[0, index]['latency'] = float(latency)
+      events[0, index]['type'] = eventType
+      events[0, index]['epoch'] = 1
+   return events
+
+def _signal(condition, channels, sampleRate, samples, random):
+   time = numpy.arange(samples) / float(sampleRate)
+   frequency = 6 + 4 * condition
+   return random.standard_normal((channels, samples)) + \
+          numpy.sin(2 * numpy.pi * frequency * time)
+
+def makeRecord(subject, condition, channels = 14, sampleRate = 128, seconds = 60,
+               dtype = 'float32', random = numpy.random):
+   """
+   Returns one EEGLAB EEG struct (as a numpy record with object fields, as
+   scipy.io.savemat expects) holding a continuous recording.
+   """
+   fields = ['subject', 'condition', 'nbchan', 'chanlocs', 'xmin', 'xmax', 'srate',
+             'pnts', 'trials', 'data', 'event']
+   record = numpy.zeros((1, 1), dtype = [(field, object) for field in fields])
+   samples = int(sampleRate * seconds)
+   data = _signal(condition, channels, sampleRate, samples, random)
+   entry = record[0, 0]
+   entry['subject'] = str(subject)
+   entry['condition'] = CONDITION_NAMES[condition]
+   entry['nbchan'] = channels
+   entry['chanlocs'] = _chanlocs(channels)
+   entry['xmin'] = 0.
+   entry['xmax'] = (samples - 1) / float(sampleRate)
+   entry['srate'] = float(sampleRate)
+   entry['pnts'] = samples
+   entry['trials'] = 1
+   entry['data'] = data.astype(dtype)
+   entry['event'] = _events(samples)
+   return record
+
+def writeAlleeg(filename, subjects = 4, channels = 14, sampleRate = 128, seconds = 60,
+                conditions = 4, seed = 0):
+   """
+   Writes a single .mat file holding an ALLEEG struct array of subjects x
+   conditions recordings, ordered by subject, as ExperimentData expects.
+   """
+   random = numpy.random.RandomState(seed)
+   records = [makeRecord(subject + 1, condition, channels, sampleRate, seconds, random = random)
+              for subject in range(subjects) for condition in range(conditions)]
+   sio.savemat(filename, {'ALLEEG': numpy.hstack(records)})
+
+def writeRecordFiles(dirname, subjects = 4, channels = 14, sampleRate = 128, seconds = 60,
+                     conditions = 4, seed = 0):
+   """
+   Writes one .mat file per recording, each holding a single EEG struct, as
+   EEGLAB's per-dataset .set files do. Returns the file names in order.
+   """
+   if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+   random = numpy.random.RandomState(seed)
+   filenames = []
+   for subject in range(subjects):
+      for condition in range(conditions):
+         filename = os.path.join(dirname, 'subject{0}_{1}.mat'.format(subject + 1,
+                                 CONDITION_NAMES[condition]))
+         record = makeRecord(subject + 1, condition, channels, sampleRate, seconds,
+                             random = random)
+         sio.savemat(filename, {'EEG': record})
+         filenames.append(filename)
+   return filenames
+
+def makeExperimentData(subjects = 4, channels = 14, sampleRate = 128, epochs = 60, epochSize = 1,
+                       conditions = 4, dtype = 'float64', seed = 0):
+   """
+   Returns an ExperimentData of subjects x conditions synthetic recordings
+   built directly in memory, without going through .mat files. Each is a
+   single continuous epoch of epochs * epochSize seconds, as loaded from our
+   exports, ready to be split with TaskRecording.splitEpochs(epochSize).
+   """
+   random = numpy.random.RandomState(seed)
+   samples = int(sampleRate * epochs * epochSize)
+   data = ExperimentData()
+   data.matrix = []
+   for subject in range(subjects):
+      tasks = []
+      for condition in range(conditions):
+         task = TaskRecording()
+         task.subject = subject + 1
+         task.condition = condition
+         task.nChans = channels
+         task.chanLabels = ['C{0}'.format(channel + 1) for channel in range(channels)]
+         task.epochSize = (samples - 1) / float(sampleRate)
+         task.sampleRate = float(sampleRate)
+         task.data = _signal(condition, channels, sampleRate, samples, random).astype(dtype)
+         task.events = [{'latency': float(latency),
+                         'name':    EVENT_NAMES[int(eventType)],
+                         'epoch':   1
+                        } for latency, eventType in zip(_eventLatencies(samples), EVENT_TYPES)]
+         task.nEpochs = 1
+         tasks.append(task)
+      data.matrix.append(tasks)
+   return data
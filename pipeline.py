@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf_8 -*-
+
+import data.convertMat as convert
+import classify.signalLearning as sigLearn
+import classify.leastSquares as leastSquares
+import classify.online as online
+import classify.metrics as metrics
+import numpy
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+"""
+Command-line batch runner for the whole pipeline, as a series of named
+stages whose outputs are checkpointed in a cache directory:
+   ingest   - EEGLAB files to the .npy cache format (cacheDir/raw)
+   epoch    - an index splitting the raw recordings into epochs (cacheDir/epochs)
+   features - per-subject feature arrays (cacheDir/features/<settings>/)
+   crossval - per-subject cross-validation results (cacheDir/results/<settings>/)
+   merge    - summary of every subject's results (cacheDir/results/<settings>/summary.json)
+
+Each stage records a hash of its inputs (input files, settings and the
+outputs of the stages before it) in a checkpoint next to its output, and is
+skipped when that hash is unchanged, so an interrupted or repeated run only
+redoes what is missing or out of date (--force redoes everything).
+
+The per-subject stages can be restricted to some subjects (--subjects 0,3-5)
+or to one shard of them (--shard 2/8), so that work can be spread over
+several nodes sharing the cache directory, e.g.:
+   python pipeline.py cache --input data/*.set --stages ingest,epoch
+   python pipeline.py cache --stages features,crossval --shard 1/2   (node 1)
+   python pipeline.py cache --stages features,crossval --shard 2/2   (node 2)
+   python pipeline.py cache --stages merge
+"""
+
+STAGES = ['ingest', 'epoch', 'features', 'crossval', 'merge']
+LEARNERS = {'Ridge':           leastSquares.RidgeClassifier,
+            'KernelRidge':     leastSquares.KernelRidgeClassifier,
+            'NearestCentroid': online.NearestCentroid}
+
+def _hash(*parts):
+   return hashlib.sha1(json.dumps(parts, sort_keys = True)).hexdigest()
+
+def _fileSignature(filename):
+   # size and modification time stand in for the contents, which may be
+   # too large to rehash on every run
+   status = os.stat(filename)
+   return [os.path.abspath(filename), status.st_size, status.st_mtime]
+
+def _writeAtomically(filename, write):
+   """
+   Calls write(temporaryFilename), then renames the result to filename, so
+   that an interrupted stage never leaves a partial output behind.
+   """
+   temporary = '{0}.{1}.tmp'.format(filename, os.getpid())
+   write(temporary)
+   os.rename(temporary, filename)
+
+def _learner(name, options):
+   if name == 'LinearSVC':
+      import scikits.learn.svm as svm
+      return svm.LinearSVC(**options)
+   if name not in LEARNERS:
+      raise ValueError("learner must be one of {0}".format(sorted(LEARNERS) + ['LinearSVC']))
+   return LEARNERS[name](**options)
+
+class Pipeline:
+   """
+   The stages of a batch run over the cache directory cacheDir. settings is
+   a dict of the options of main (see its --help).
+   """
+
+   def __init__(self, cacheDir, settings):
+      self.cacheDir = cacheDir
+      self.settings = settings
+      self.force = settings.get('force', False)
+
+   def _path(self, *parts):
+      return os.path.join(self.cacheDir, *parts)
+
+   def _upToDate(self, checkpoint, inputHash):
+      """
+      Returns whether the stage with the given checkpoint file last ran with
+      inputs hashing to inputHash.
+      """
+      if self.force or not os.path.exists(checkpoint):
+         return False
+      return json.load(open(checkpoint))['inputHash'] == inputHash
+
+   def _invalidate(self, checkpoint):
+      # dropped before a stage rewrites its output in place, so that an
+      # interrupted rewrite isn't taken to be up to date
+      if os.path.exists(checkpoint):
+         os.remove(checkpoint)
+
+   def _checkpoint(self, checkpoint, stage, inputHash):
+      record = {'stage': stage, 'inputHash': inputHash,
+                'finished': time.strftime("%Y-%m-%d %H:%M:%S")}
+      _writeAtomically(checkpoint, lambda name: json.dump(record, open(name, 'w'), indent = 1))
+
+   def _indexHash(self, dirname):
+      return _hash(json.load(open(os.path.join(dirname, convert.CACHE_INDEX))))
+
+   def ingest(self):
+      inputs = self.settings.get('input') or []
+      if not inputs:
+         raise ValueError("ingest needs --input files")
+      inputHash = _hash('ingest', [_fileSignature(filename) for filename in inputs],
+                        self.settings.get('compact', False))
+      checkpoint = self._path('raw', 'checkpoint.json')
+      if self._upToDate(checkpoint, inputHash):
+         print "ingest: up to date"
+         return
+      print "ingest: converting {0} files".format(len(inputs))
+      self._invalidate(checkpoint)
+      convert.ingest(inputs, self._path('raw'), self.settings.get('workers', 1),
+                     compact = self.settings.get('compact', False))
+      self._checkpoint(checkpoint, 'ingest', inputHash)
+
+   def _epochHash(self):
+      return _hash('epoch', self._indexHash(self._path('raw')), self.settings['epochSize'],
+                   self.settings.get('step'))
+
+   def epoch(self):
+      inputHash = self._epochHash()
+      checkpoint = self._path('epochs', 'checkpoint.json')
+      if self._upToDate(checkpoint, inputHash):
+         print "epoch: up to date"
+         return
+      print "epoch: splitting into {0}s epochs".format(self.settings['epochSize'])
+      self._invalidate(checkpoint)
+      convert.epochCache(self._path('raw'), self._path('epochs'), self.settings['epochSize'],
+                         self.settings.get('step'))
+      self._checkpoint(checkpoint, 'epoch', inputHash)
+
+   def _data(self):
+      checkpoint = self._path('epochs', 'checkpoint.json')
+      if (not os.path.exists(checkpoint)
+          or json.load(open(checkpoint))['inputHash'] != self._epochHash()):
+         raise ValueError("the epochs in {0} don't match these settings; run the epoch stage "
+                          "first".format(self._path('epochs')))
+      data = convert.ExperimentData()
+      data.loadCache(self._path('epochs'), compact = self.settings.get('compact', False))
+      return data
+
+   def subjects(self):
+      """
+      Returns the indices of the subjects selected by the subjects and
+      shard settings.
+      """
+      index = json.load(open(self._path('epochs', convert.CACHE_INDEX)))
+      subjects = range(index['subjects'])
+      if self.settings.get('subjects') != None:
+         subjects = [subject for subject in subjects if subject in self.settings['subjects']]
+      if self.settings.get('shard') != None:
+         shard, shards = self.settings['shard']
+         subjects = subjects[shard - 1::shards]
+      return subjects
+
+   def _subjectHash(self, subject):
+      """
+      Hashes the index entries of one subject's recordings, so that each
+      subject's features only depend on its own data.
+      """
+      index = json.load(open(self._path('epochs', convert.CACHE_INDEX)))
+      entries = [entry for entry in index['records'] if entry['position'][0] == subject]
+      return _hash(entries, [_fileSignature(os.path.join(self._path('epochs'), entry['file']))
+                             for entry in entries])
+
+   def _featureSettings(self):
+      return [self.settings['epochSize'], self.settings.get('step'), self.settings['feature'],
+              self.settings['bins']]
+
+   def _crossValSettings(self):
+      return self._featureSettings() + [self.settings['learner'],
+                                        self.settings.get('options', {}),
+                                        self.settings['validator'], self.settings['k']]
+
+   def _featureDir(self):
+      return self._path('features', _hash(self._featureSettings())[:12])
+
+   def _resultDir(self):
+      return self._path('results', _hash(self._crossValSettings())[:12])
+
+   def features(self, data, subject):
+      inputHash = _hash('features', self._subjectHash(subject), self._featureSettings())
+      dirname = self._featureDir()
+      checkpoint = os.path.join(dirname, 'subject{0}.json'.format(subject))
+      if self._upToDate(checkpoint, inputHash):
+         print "features: subject {0} up to date".format(subject)
+         return inputHash
+      if not os.path.isdir(dirname):
+         os.makedirs(dirname)
+      print "features: subject {0}".format(subject)
+      sigLearnInstance = sigLearn.SignalLearn()
+      if self.settings['feature'] == 'spectral':
+         sample, classes = sigLearnInstance.getSpectralDecompArray(data, self.settings['bins'],
+                                                                   subject)
+      else:
+         sample, classes = sigLearnInstance.getFeatureMatrix(data, subject)
+      _writeAtomically(os.path.join(dirname, 'subject{0}.npz'.format(subject)),
+            lambda name: numpy.savez(open(name, 'wb'), sample = sample, classes = classes))
+      self._checkpoint(checkpoint, 'features', inputHash)
+      return inputHash
+
+   def crossValidate(self, subject, featureHash):
+      inputHash = _hash('crossval', featureHash, self._crossValSettings())
+      dirname = self._resultDir()
+      resultFile = os.path.join(dirname, 'subject{0}.json'.format(subject))
+      if (not self.force and os.path.exists(resultFile)
+          and json.load(open(resultFile))['inputHash'] == inputHash):
+         print "crossval: subject {0} up to date".format(subject)
+         return
+      if not os.path.isdir(dirname):
+         os.makedirs(dirname)
+      print "crossval: subject {0}".format(subject)
+      arrays = numpy.load(os.path.join(self._featureDir(), 'subject{0}.npz'.format(subject)))
+      sample, classes = arrays['sample'], arrays['classes']
+      sample = sample.reshape((len(sample), -1))
+      learner = _learner(self.settings['learner'], self.settings.get('options', {}))
+      sigLearnInstance = sigLearn.SignalLearn()
+      workers = self.settings.get('workers', 1)
+      if self.settings['validator'] == 'leaveOneOut':
+         results, accuracy, classAccuracy = sigLearnInstance.leaveOneOut(sample, classes,
+               learner.fit, learner.predict, workers)
+      else:
+         validator = getattr(sigLearnInstance, self.settings['validator'])
+         results, accuracy, classAccuracy = validator(sample, classes, learner.fit,
+               learner.predict, self.settings['k'], workers)
+      record = {'inputHash': inputHash, 'subject': subject, 'settings': self._crossValSettings(),
+                'accuracy': accuracy, 'classAccuracy': classAccuracy,
+                'labels': numpy.unique(classes).tolist(), 'results': numpy.asarray(results).tolist()}
+      _writeAtomically(resultFile, lambda name: json.dump(record, open(name, 'w')))
+
+   def merge(self):
+      """
+      Gathers the per-subject results of the current settings into
+      summary.json, in the form of testModules.runSpectralCrossValidation
+      plus metrics.subjectSummary, and returns it. classAccuracies has a
+      column for each of labels, found across every subject, with None for
+      classes a subject does not have.
+      """
+      dirname = self._resultDir()
+      records = []
+      if os.path.isdir(dirname):
+         records = [json.load(open(os.path.join(dirname, name))) for name in sorted(os.listdir(dirname))
+                    if name.startswith('subject') and name.endswith('.json')]
+      if not records:
+         raise ValueError("no results to merge in {0}".format(dirname))
+      records.sort(key = lambda record: record['subject'])
+      labels = numpy.unique(numpy.concatenate([record['labels'] for record in records]))
+      perSubjectAccuracy = numpy.array([record['accuracy'] for record in records])
+      classAccuracies = numpy.empty((len(records), len(labels)))
+      classAccuracies.fill(numpy.nan)
+      for row, record in enumerate(records):
+         columns = numpy.searchsorted(labels, record['labels'])
+         classAccuracies[row, columns] = record['classAccuracy']
+      summary = metrics.subjectSummary(perSubjectAccuracy, classAccuracies)
+      merged = {'settings': self._crossValSettings(),
+                'subjects': [record['subject'] for record in records],
+                'labels': labels.tolist(),
+                'perSubjectAccuracy': perSubjectAccuracy.tolist(),
+                'classAccuracies': [[None if numpy.isnan(value) else value for value in row]
+                                    for row in classAccuracies.tolist()],
+                'summary': dict([(name, numpy.asarray(value).tolist())
+                                 for name, value in summary.items()])}
+      _writeAtomically(os.path.join(dirname, 'summary.json'),
+                       lambda name: json.dump(merged, open(name, 'w'), indent = 1))
+      print "merge: {0} subjects, mean accuracy {1:.3f}".format(len(records), summary['mean'])
+      return merged
+
+   def run(self, stages):
+      for stage in stages:
+         if stage not in STAGES:
+            raise ValueError("stages must be among {0}".format(STAGES))
+      if 'ingest' in stages:
+         self.ingest()
+      if 'epoch' in stages:
+         self.epoch()
+      if 'features' in stages or 'crossval' in stages:
+         data = self._data()
+         for subject in self.subjects():
+            featureHash = self.features(data, subject)
+            if 'crossval' in stages:
+               self.crossValidate(subject, featureHash)
+      if 'merge' in stages:
+         return self.merge()
+
+def _subjectList(text):
+   subjects = []
+   for part in text.split(','):
+      if '-' in part:
+         first, last = part.split('-')
+         subjects.extend(range(int(first), int(last) + 1))
+      else:
+         subjects.append(int(part))
+   return subjects
+
+def _shard(text):
+   shard, shards = [int(part) for part in text.split('/')]
+   if not 1 <= shard <= shards:
+      raise argparse.ArgumentTypeError("shard must be given as i/n, with 1 <= i <= n")
+   return shard, shards
+
+def _option(text):
+   name, value = text.split('=', 1)
+   try:
+      value = json.loads(value)
+   except ValueError:
+      pass
+   return name, value
+
+def main(*args):
+   parser = argparse.ArgumentParser(
+         description = 'Run the EEG pipeline in resumable stages, checkpointed in cacheDir.')
+   parser.add_argument('cacheDir', help = 'directory holding every stage\'s output')
+   parser.add_argument('--stages', default = ','.join(STAGES),
+         help = 'comma separated stages to run, among ' + ', '.join(STAGES))
+   parser.add_argument('--input', nargs = '+',
+         help = 'ALLEEG .mat file, or per-recording .mat/.set files (ingest)')
+   parser.add_argument('--compact', action = 'store_true', help = 'store samples as float32')
+   parser.add_argument('--epochSize', type = float, default = 1, help = 'seconds per epoch')
+   parser.add_argument('--step', type = float, default = None,
+         help = 'seconds between epoch starts (default epochSize)')
+   parser.add_argument('--feature', choices = ['spectral', 'features'], default = 'spectral',
+         help = 'binned spectra, or the features module\'s time domain and band power features')
+   parser.add_argument('--bins', type = int, default = 32, help = 'spectral bins')
+   parser.add_argument('--learner', default = 'LinearSVC',
+         help = 'one of ' + ', '.join(sorted(LEARNERS) + ['LinearSVC']))
+   parser.add_argument('--option', type = _option, action = 'append', default = [],
+         help = 'learner option as name=value, e.g. C=0.1 (repeatable)')
+   parser.add_argument('--validator', default = 'stratifiedKFoldVal',
+         choices = ['kFoldVal', 'stratifiedKFoldVal', 'leaveOneOut'])
+   parser.add_argument('-k', type = int, default = 10, help = 'folds for k-fold validation')
+   parser.add_argument('--subjects', type = _subjectList, default = None,
+         help = 'subject indices to process, e.g. 0,3-5')
+   parser.add_argument('--shard', type = _shard, default = None,
+         help = 'process only the i-th of n equal shares of the subjects, as i/n')
+   parser.add_argument('--workers', type = int, default = 1,
+         help = 'processes for ingestion and cross-validation folds')
+   parser.add_argument('--force', action = 'store_true', help = 'rerun up to date stages')
+   argsParsed = parser.parse_args(args[1:])
+
+   settings = vars(argsParsed)
+   settings['options'] = dict(settings.pop('option'))
+   Pipeline(argsParsed.cacheDir, settings).run(argsParsed.stages.split(','))
+
+if __name__ == "__main__":
+   main(*sys.argv)
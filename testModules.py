@@ -4,6 +4,7 @@
 import data.convertMat as convert
 import classify.signalLearning as sigLearn
 import classify.spectrum as spectrum
+import classify.parallel as parallel
 import numpy
 import scikits.learn.svm as svm
 import scikits.learn.cross_val as cross_val
@@ -23,28 +24,57 @@ Of course, data needs to be initialised first- e.g.:
       for task in subject:
          task.splitEpochs(1)
 Which will produce a dataset with a large number of 1 second 
-non-overlapping epochs/segments.
+non-overlapping epochs/segments. task.splitEpochs(1, 0.25) would instead
+produce overlapping 1 second epochs starting every 250ms.
+
+Without access to the recordings, a synthetic dataset of the same shape can
+be used in their place, split in the same way:
+   import data.synthetic as synthetic
+   data = synthetic.makeExperimentData(subjects = 4, epochs = 300)
 """
 
 def checkClassAccuracies(accuracies):
-    count = 0
-    for accuracy in accuracies.flatten():
-       if accuracy > 0.5:
-          count += 1
-    return numpy.true_divide(count, accuracies.size)
+    return numpy.true_divide((accuracies > 0.5).sum(), accuracies.size)
 
-def runSpectralCrossValidation(data, bins, learner, crossValidator, k = None)
+def _crossValidateSubject(context, i):
+   data, bins, learner, crossValidator, k = context
    sigLearnInstance = sigLearn.SignalLearn()
+   sample, classes = sigLearnInstance.getSpectralDecompArray(data, bins, i)
+   if k == None:
+      results, accuracy, classAccuracy = \
+            crossValidator(sample, classes, learner.fit, learner.predict)
+   else:
+      results, accuracy, classAccuracy = \
+            crossValidator(sample, classes, learner.fit, learner.predict, k)
+   return i, accuracy, classAccuracy
+
+def runSpectralCrossValidation(data, bins, learner, crossValidator, k = None):
    perSubjectAccuracy = numpy.zeros(len(data.matrix))
    classAccuracies = numpy.zeros((len(data.matrix), 4))
-   for i, subject in zip(range(len(data.matrix)), data.matrix):
+   context = (data, bins, learner, crossValidator, k)
+   for i in range(len(data.matrix)):
       print "Starting subject {0}/{1}".format(i + 1, len(data.matrix))
-      sample, classes = sigLearnInstance.getSpectralDecomp(data, bins, i)
-      if k == None:
-         results, perSubjectAccuracy[i], classAccuracies[i] = \
-               crossValidator(sample, classes, learner.fit, learner.predict)
-      else:
-         results, perSubjectAccuracy[i], classAccuracies[i] = \
-               crossValidator(sample, classes, learner.fit, learner.predict, k)
+      i, perSubjectAccuracy[i], classAccuracies[i] = _crossValidateSubject(context, i)
+
+   return perSubjectAccuracy, classAccuracies
+
+def runSpectralCrossValidationParallel(data, bins, learner, crossValidator, k = None, workers = None):
+   """
+   Same as runSpectralCrossValidation, but subjects are processed
+   independently across a pool of workers processes (one per CPU if None).
+   Only the subjects currently being processed have their features resident,
+   so at most workers subjects' features are in memory at once. Progress is
+   printed as each subject finishes.
+   """
+   perSubjectAccuracy = numpy.zeros(len(data.matrix))
+   classAccuracies = numpy.zeros((len(data.matrix), 4))
+   context = (data, bins, learner, crossValidator, k)
+   done = 0
+   for i, accuracy, classAccuracy in parallel.forkMap(_crossValidateSubject, context,
+         range(len(data.matrix)), workers, ordered = False):
+      perSubjectAccuracy[i], classAccuracies[i] = accuracy, classAccuracy
+      done += 1
+      print "Finished subject {0} ({1}/{2}), accuracy {3}".format(i + 1, done,
+            len(data.matrix), accuracy)
 
    return perSubjectAccuracy, classAccuracies